@@ -1,6 +1,13 @@
+import os
 import sys
-import socket
 import json
+import time
+import atexit
+import signal
+import threading
+from calendar import monthrange
+from collections import OrderedDict
+from itertools import filterfalse, islice
 
 from PyQt5.QtWidgets import ( # подключение всех необходимых виджетов для интерфейса
     QApplication,
@@ -13,69 +20,184 @@ from PyQt5.QtWidgets import ( # подключение всех необходи
     QMessageBox,
     QListWidget,
     QListWidgetItem,
+    QListView,
+    QAbstractItemView,
     QCalendarWidget,
     QDialog,
     QDialogButtonBox,
     QInputDialog,
     QFormLayout,
-    QDateEdit
+    QDateEdit,
+    QFileDialog,
+    QProgressDialog,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView
 )
-from PyQt5.QtCore import Qt, QDate, QPoint
-from PyQt5.QtGui import QPainter, QColor
+from PyQt5.QtCore import Qt, QDate, QRect, QObject, QEvent, pyqtSignal, QAbstractListModel, QModelIndex, QTimer
+from PyQt5.QtGui import QPainter, QColor, QFont
+
+from network import ServerConnection
+from protocol import CONTACT_FIELDS, Contact
+from client import (
+    Client,
+    refused,
+    contact_command,
+    contacts_batch_command,
+    event_command,
+    events_batch_command,
+    SUCCESSFUL_LOGIN,
+    WRONG_LOGIN,
+    WRONG_PASSWORD,
+    LOGIN_EXISTS,
+    SUCCESSFUL_CHANGE_PASSWORD,
+    DUPLICATE_CONTACT
+)
+from cache import LocalCache
+from validation import check_sql_injection, validate_contact, normalize_contact, normalize_phone, DUPLICATE_PHONE
+from importer import ContactImporter
+from exporter import ExportFile, EVENT_FIELDS
+from search import ContactIndex, SORT_CHUNK
+from mutations import MutationQueue
+from journal import Journal
+from telemetry import telemetry
+from watchdog import StallWatchdog
+
+cache = None # локальный кэш данных, открывается при запуске
+
+class ReplyDispatcher(QObject): # переносит ответы сервера из сетевого потока в поток интерфейса
+    replied = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.replied.connect(self.deliver, Qt.QueuedConnection)
 
-clientSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # привязка сокета
+    def deliver(self, callback, answer):
+        callback(answer)
 
-def send_to_server(message): # отправка сообщения на сервер и получение ответа
-    try:
-        clientSock.sendall(message.encode())
-        response = clientSock.recv(65536)
-        return response.decode()
-    except Exception as e:
-        print(f"Error communicating with server: {e}")
+dispatcher = ReplyDispatcher()
+client = Client(ServerConnection(), deliver=dispatcher.replied.emit) # ответы уже разобраны в сетевом потоке, callback получит их в потоке интерфейса
+
+mutations = MutationQueue(client.request) # изменения, которые интерфейс уже показал, а сервер еще не подтвердил
+NO_CONNECTION = ('Нет связи', 'Сервер недоступен, попробуйте позже')
+
+def not_loaded(result): # None - нет связи, строка - сервер ответил ошибкой; в обоих случаях остаются прежние данные
+    if refused(result):
+        print(f'Server refused to send data: {result}')
+    return result is None or refused(result)
+
+def lost_reason(result): # почему не пришли данные для выгрузки
+    return 'Соединение с сервером потеряно' if result is None else f'Сервер ответил ошибкой ({result})'
+
+HEAT_MAX = 5 # с этого числа событий день закрашивается самым ярким цветом
+HEAT_COLORS = [QColor(255, 0, 0, 25 + 110 * level // HEAT_MAX) for level in range(HEAT_MAX + 1)]
+BADGE_COLOR = QColor(220, 0, 0)
+BADGE_SIZE = 16
 
 class CustomCalendarWidget(QCalendarWidget): # модифицируем календарь для отображения событий
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.events = {}
+        self.events = {} # дата -> {название: сколько раз}, удаление не перебирает список дня
+        self.paint_start = 0 # юлианский день первой ячейки таблицы отрисовки
+        self.paint_cells = [] # по дню показанной страницы: None или (цвет заливки, число на значке)
+        self.badge_font = QFont(self.font())
+        self.badge_font.setPointSize(7)
+        self.currentPageChanged.connect(self.build_paint_table)
+        self.build_paint_table()
+
+    def build_paint_table(self, year=None, month=None): # таблица на показанную страницу: месяц и соседние недели в сетке
+        first = QDate(year or self.yearShown(), month or self.monthShown(), 1)
+        self.paint_start = first.toJulianDay() - 7
+        self.paint_cells = [self.paint_cell(QDate.fromJulianDay(self.paint_start + day))
+                            for day in range(7 + first.daysInMonth() + 14)]
+
+    def paint_cell(self, date): # заливка по числу событий дня и текст значка
+        day = self.events.get(date)
+        if not day:
+            return None
+        count = sum(day.values())
+        return HEAT_COLORS[min(count, HEAT_MAX)], str(count) if count < 100 else '99+'
+
+    def update_paint_cell(self, date): # изменился один день: пересчитывается только его ячейка
+        offset = date.toJulianDay() - self.paint_start
+        if 0 <= offset < len(self.paint_cells):
+            self.paint_cells[offset] = self.paint_cell(date)
+        self.updateCell(date)
+
+    def update_paint_table(self): # пачка изменений: таблица строится заново и календарь перерисовывается один раз
+        self.build_paint_table()
+        self.updateCells()
 
     def paintCell(self, painter, rect, date):
         super().paintCell(painter, rect, date)
-        if date in self.events:
-            painter.setBrush(QColor(255, 0, 0))
-            painter.drawEllipse(rect.topLeft() + QPoint(3, 3), 3, 3) # нарисуем красные точки в углу, если есть данные
+        offset = date.toJulianDay() - self.paint_start
+        cell = self.paint_cells[offset] if 0 <= offset < len(self.paint_cells) else None
+        if cell is None:
+            return
+        color, text = cell
+        painter.save()
+        painter.fillRect(rect, color)
+        badge = QRect(rect.left() + 2, rect.top() + 2, BADGE_SIZE, BADGE_SIZE) # значок с числом событий в углу
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(BADGE_COLOR)
+        painter.drawEllipse(badge)
+        painter.setPen(Qt.white)
+        painter.setFont(self.badge_font)
+        painter.drawText(badge, Qt.AlignCenter, text)
+        painter.restore()
 
     def setEvent(self, date, event):
-        if date not in self.events:
-            self.events[date] = []
-        self.events[date].append(event)
-        self.updateCell(date)
+        day = self.events.setdefault(date, {})
+        day[event] = day.get(event, 0) + 1
+        self.update_paint_cell(date)
+
+    def setEvents(self, mapping): # замена всех событий {дата: [названия]} и одна перерисовка
+        self.events = {}
+        self.addEvents(mapping)
+
+    def addEvents(self, mapping): # добавление пачки событий {дата: [названия]} и одна перерисовка
+        for date, names in mapping.items():
+            day = self.events.setdefault(date, {})
+            for name in names:
+                day[name] = day.get(name, 0) + 1
+        self.update_paint_table()
+
+    def setDaysEvents(self, mapping): # замена событий отдельных дней {дата: [названия]} и одна перерисовка
+        for date in mapping:
+            self.events.pop(date, None)
+        self.addEvents({date: names for date, names in mapping.items() if names})
+
+    def setMonthEvents(self, year, month, mapping): # замена событий одного месяца
+        self.dropMonth(year, month)
+        self.addEvents(mapping)
 
     def getEvents(self, date):
-        return self.events.get(date, [])
+        return [name for name, count in self.events.get(date, {}).items() for _ in range(count)]
 
     def removeEvent(self, date, event):
-        if date in self.events:
-            self.events[date].remove(event)
-            if not self.events[date]:
+        day = self.events.get(date)
+        if day and event in day:
+            day[event] -= 1
+            if not day[event]:
+                del day[event]
+            if not day:
                 del self.events[date]
-            self.updateCell(date)
+            self.update_paint_cell(date)
 
-def check_sql_injection(to_check, what_to_check): # ограничение используемых символов в полях ввода
-    for i in to_check:
-        if what_to_check == 'login' and not (i.isalnum() or i == '_'):
-            return True
-        elif what_to_check == 'password' and not(i.isalnum() or i in '!#$%&()*+-:;<=>?@[]^_{|}~'):
-            return True
-        elif what_to_check == 'word' and not(i.isalpha()):
-            return True
-        elif what_to_check == 'number' and not(i.isdigit()):
-            return True
-        elif what_to_check == 'number+word' and not(i.isalnum()):
-            return True
-        elif what_to_check == 'simple lable' and not(i.isalnum() or i in ' :-_'):
-            return True
+    def clearEvents(self):
+        self.events = {}
+        self.update_paint_table()
+
+    def clearMonth(self, year, month): # убрать события месяца, вытесненного из кэша окна
+        self.dropMonth(year, month)
+        self.update_paint_table()
+
+    def dropMonth(self, year, month):
+        for date in [date for date in self.events if date.month() == month and date.year() == year]:
+            del self.events[date]
 
 current_login = None
+current_password = None # нужен, чтобы после восстановления связи заново подтвердить вход, сделанный без нее
 
 class LoginWindow(QWidget): # окно авторизации
     def __init__(self, switch_to_register, switch_to_main):
@@ -110,7 +232,6 @@ class LoginWindow(QWidget): # окно авторизации
         self.setStyleSheet(self.get_stylesheet()) # подключаем стиль
 
     def login_user(self): # авторизация
-        global current_login
         username = self.entry_username.text()
         password = self.entry_password.text()
 
@@ -132,14 +253,28 @@ class LoginWindow(QWidget): # окно авторизации
             QMessageBox.warning(self, 'Ошибка пароля', 'Запрещенные символы в пароле (могут быть только буквы, цифры и !#$%&()*+-:;<=>?@[]^_{|}~)')
             return
 
-        answer = send_to_server(f"login {username} {password}") # пробуем войти
-
-        if answer == "wrong login": # нет пользователя
+        self.login_button.setEnabled(False) # пока ждем ответ, повторно не отправляем
+        client.login(username, password, lambda answer: self.on_login_answer(username, password, answer)) # пробуем войти
+
+    def on_login_answer(self, username, password, answer): # ответ сервера на авторизацию
+        global current_login, current_password
+        self.login_button.setEnabled(True)
+
+        if answer is None: # сервер недоступен: работаем с локальной копией, изменения копятся в журнале
+            if not cache.check_password(username, password): # пароль сверяется с последним входом через сервер
+                QMessageBox.warning(self, *NO_CONNECTION)
+                return
+            QMessageBox.information(self, 'Нет связи с сервером', 'Показаны сохраненные данные, изменения будут отправлены после восстановления связи')
+            current_login, current_password = username, password
+            self.switch_to_main()
+        elif answer == WRONG_LOGIN: # нет пользователя
             QMessageBox.warning(self, 'Ошибка логина', 'Несуществующее имя пользователя')
-        elif answer == "wrong password": # неверный пароль
+        elif answer == WRONG_PASSWORD: # неверный пароль
             QMessageBox.warning(self, 'Ошибка пароля', 'Неверный пароль')
         else:
-            current_login = username
+            cache.remember_password(username, password)
+            current_login, current_password = username, password
+            mutations.replay(on_journal_replayed, username) # изменения, сделанные без связи, уходят после подтвержденного входа
             self.switch_to_main() # переключение на окно контактов
 
     def get_stylesheet(self): # стиль
@@ -237,9 +372,16 @@ class RegistrationWindow(QWidget): # окно регистрации
             QMessageBox.warning(self, 'Ошибка пароля', 'Запрещенные символы в пароле (могут быть только буквы, цифры и !#$%&()*+-:;<=>?@[]^_{|}~)')
             return
 
-        answer = send_to_server(f"register {username} {password} {confirm_password}") # пробуем зарегистрировать
+        self.register_button.setEnabled(False)
+        client.register(username, password, confirm_password, lambda answer: self.on_register_answer(username, answer)) # пробуем зарегистрировать
 
-        if answer == "login already exists": # пользователь уже существует
+    def on_register_answer(self, username, answer): # ответ сервера на регистрацию
+        self.register_button.setEnabled(True)
+
+        if answer is None:
+            QMessageBox.warning(self, *NO_CONNECTION)
+            return
+        if answer == LOGIN_EXISTS: # пользователь уже существует
             QMessageBox.warning(self, 'Ошибка логина', 'Пользователь с таким именем уже существует')
             return
 
@@ -338,11 +480,6 @@ class ChangePasswordWindow(QWidget): # окно смены пароля
             QMessageBox.warning(self, 'Ошибка ввода', 'Заполните все поля')
             return
 
-        check_old = send_to_server(f'login {current_login} {old_password}') # проверяем, точно ли пользователь знает прежний пароль
-        if check_old == 'wrong password':
-            QMessageBox.warning(self, 'Ошибка пароля', 'Старый пароль неверный')
-            return
-
         if len(new_password) > 32:
             QMessageBox.warning(self, 'Ошибка пароля', 'Новый пароль слишком длинный\nМаксимум 32 символа')
             return
@@ -359,8 +496,32 @@ class ChangePasswordWindow(QWidget): # окно смены пароля
             QMessageBox.warning(self, 'Ошибка пароля', 'Нельзя оставить старый пароль')
             return
 
-        answer = send_to_server(f"change_password {current_login} {new_password}") # отправляем запрос на смену пароля
+        self.change_password_button.setEnabled(False)
+        client.login(current_login, old_password, lambda answer: self.on_check_old_answer(new_password, answer)) # проверяем, точно ли пользователь знает прежний пароль
+
+    def on_check_old_answer(self, new_password, answer): # ответ на проверку старого пароля
+        if answer is None:
+            self.change_password_button.setEnabled(True)
+            QMessageBox.warning(self, *NO_CONNECTION)
+            return
+        if answer == WRONG_PASSWORD:
+            self.change_password_button.setEnabled(True)
+            QMessageBox.warning(self, 'Ошибка пароля', 'Старый пароль неверный')
+            return
 
+        client.change_password(current_login, new_password, lambda answer: self.on_change_password_answer(new_password, answer)) # отправляем запрос на смену пароля
+
+    def on_change_password_answer(self, new_password, answer): # ответ на смену пароля
+        global current_password
+        self.change_password_button.setEnabled(True)
+        if answer is None:
+            QMessageBox.warning(self, *NO_CONNECTION)
+            return
+        if answer != SUCCESSFUL_CHANGE_PASSWORD: # пароль на сервере прежний - и для входа без связи тоже
+            QMessageBox.warning(self, 'Смена пароля', f'Сервер не сменил пароль: {answer}')
+            return
+        cache.remember_password(current_login, new_password)
+        current_password = new_password
         QMessageBox.information(self, 'Смена пароля', f'Пароль успешно изменен') # оповещение
 
         # очищаем формы
@@ -400,54 +561,312 @@ class ChangePasswordWindow(QWidget): # окно смены пароля
             }
         """
 
-contacts = []
+SEARCH_ROWS = 200 # сколько найденных контактов разбирать сразу, остальные - по мере прокрутки
+
+class ContactsModel(QAbstractListModel): # модель списка контактов, представление рисует только видимые строки
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.contacts = [] # показанные строки: все контакты или уже разобранная часть результата поиска
+        self.contact_index = ContactIndex() # все контакты пользователя
+        self.query = ''
+        self.results = None # итератор по остатку результата поиска; None - индекс менялся, остаток ищется заново
+        self.more = False # есть ли неразобранный остаток
+        self.rows = {} # приведенный номер -> строка; верно для строк до rows_valid, дальше пересчитывается при поиске
+        self.rows_valid = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.contacts)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.contacts[index.row()].title()
+        return None
+
+    def contact(self, row):
+        return self.contacts[row]
+
+    def all_contacts(self): # все контакты независимо от строки поиска
+        return list(self.contact_index.values())
+
+    def set_filter(self, text): # показать только подходящие под строку поиска контакты
+        self.query = text.strip()
+        self.beginResetModel()
+        self.rows, self.rows_valid = {}, 0
+        self.results = self.contact_index.search(self.query)
+        if self.query:
+            self.contacts = list(islice(self.results, SEARCH_ROWS))
+            self.more = len(self.contacts) == SEARCH_ROWS
+        else: # весь список - одна копия без разбора
+            self.contacts = list(self.results)
+            self.more = False
+        self.endResetModel()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.more
+
+    def fetchMore(self, parent=QModelIndex()): # представление докрутило до конца разобранных строк
+        if parent.isValid() or not self.more:
+            return
+        if self.results is None: # итератор по измененному индексу недействителен: новый поиск без уже показанных строк
+            shown = set(self.contacts)
+            self.results = filterfalse(shown.__contains__, self.contact_index.search(self.query))
+        rows = list(islice(self.results, SEARCH_ROWS))
+        self.more = len(rows) == SEARCH_ROWS
+        if rows:
+            first = len(self.contacts)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self.contacts.extend(rows)
+            self.endInsertRows()
+
+    def index_changed(self): # вызывается перед каждым изменением индекса
+        self.results = None
+
+    def append_contacts(self, new_contacts): # добавить пачку контактов в конец
+        self.index_changed()
+        if len(new_contacts) == 1:
+            self.contact_index.add(new_contacts[0])
+        else:
+            self.contact_index.extend(new_contacts)
+        if self.query:
+            new_contacts = [contact for contact in new_contacts if self.contact_index.matches(contact, self.query)]
+        if not new_contacts:
+            return
+        first = len(self.contacts)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_contacts) - 1)
+        self.contacts.extend(new_contacts)
+        self.endInsertRows()
+
+    def add_contact(self, contact):
+        self.append_contacts([contact])
+
+    def remove_row(self, row):
+        self.index_changed()
+        self.contact_index.remove(self.contacts[row].phone)
+        self.rows.pop(normalize_phone(self.contacts[row].phone), None)
+        self.rows_valid = min(self.rows_valid, row) # строки ниже сдвинулись
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.contacts[row]
+        self.endRemoveRows()
+
+    def remove_rows(self, rows): # удаление нескольких строк: подряд идущие убираются одним диапазоном
+        self.index_changed()
+        ranges = []
+        for row in sorted(rows):
+            self.contact_index.remove(self.contacts[row].phone)
+            self.rows.pop(normalize_phone(self.contacts[row].phone), None)
+            self.rows_valid = min(self.rows_valid, row)
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        for first, last in reversed(ranges): # с конца, чтобы номера строк не сдвигались
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.contacts[first:last + 1]
+            self.endRemoveRows()
+
+    def update_row(self, row, contact): # замена записи и перерисовка одной строки
+        self.index_changed()
+        old = self.contacts[row]
+        if old.phone != contact.phone:
+            self.contact_index.remove(old.phone)
+            self.rows.pop(normalize_phone(old.phone), None)
+            if row < self.rows_valid:
+                self.rows[normalize_phone(contact.phone)] = row
+        self.contact_index.add(contact)
+        self.contacts[row] = contact
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self.contacts = []
+        self.results = None
+        self.more = False
+        self.rows, self.rows_valid = {}, 0
+        self.contact_index.clear()
+        self.endResetModel()
+
+    def find_row(self, phone): # строка контакта; номера строк после удалений пересчитываются один раз, а не на каждый поиск
+        phone = normalize_phone(phone)
+        if phone not in self.contact_index.contacts:
+            return None
+        if self.rows_valid < len(self.contacts):
+            rows = self.rows
+            for row in range(self.rows_valid, len(self.contacts)):
+                rows[normalize_phone(self.contacts[row].phone)] = row
+            self.rows_valid = len(self.contacts)
+        return self.rows.get(phone)
+
+    def replace_contact(self, phone, contact): # контакт с номером phone заменить на contact: None - удалить, phone=None - добавить
+        row = self.find_row(phone) if phone else None
+        if row is not None:
+            if contact is None:
+                self.remove_row(row)
+            else:
+                self.update_row(row, contact)
+        elif phone and phone in self.contact_index: # скрыт поиском или еще не разобран
+            self.index_changed()
+            self.contact_index.remove(phone)
+            if contact is not None:
+                self.add_contact(contact)
+        elif contact is not None:
+            self.add_contact(contact)
+
+    def apply_delta(self, reset, changes): # изменения с сервера: по каждому номеру применяется только итог
+        final = {} # приведенный номер -> контакт, None - удален
+        for operation, value in changes:
+            if operation == '+':
+                final[normalize_phone(value.phone)] = value
+            else:
+                final[normalize_phone(value)] = None
+        if reset: # полный снимок - одна вставка строк, слова для поиска раскладываются одним разом
+            self.clear()
+            self.append_contacts([contact for contact in final.values() if contact is not None])
+            return
+
+        self.index_changed()
+        removed = []
+        added = []
+        for phone, contact in final.items():
+            row = self.find_row(phone)
+            if row is not None:
+                if contact is None:
+                    removed.append(row)
+                else:
+                    self.update_row(row, contact)
+            elif contact is None:
+                self.contact_index.remove(phone) # контакт скрыт поиском или еще не разобран
+            elif phone in self.contact_index:
+                self.contact_index.add(contact)
+            else:
+                added.append(contact)
+        if removed:
+            self.remove_rows(removed)
+        if added:
+            self.append_contacts(added)
+
+CONTACTS_PAGE_SIZE = 500 # сколько контактов запрашивать за раз
+REFRESH_AFTER = 30 # через сколько секунд данные открытого ранее окна считаются устаревшими
+
 class ContactsWindow(QWidget): # окно контактов
     def __init__(self, switch_to_events, switch_to_main, switch_to_login):
         super().__init__()
         self.switch_to_events = switch_to_events
         self.switch_to_main = switch_to_main
         self.switch_to_login = switch_to_login
+        self.login = current_login # окно принадлежит сессии этого пользователя
+        self.syncing = False
+        self.synced_at = 0
+        self.after_sync = [] # что выполнить, когда текущая загрузка закончится
+        self.imported = set()
         self.initUI()
         self.load_contacts()
 
-    def load_contacts(self): # прогрузка контактов из бд
-        global contacts, current_login
+    def load_contacts(self): # прогрузка контактов: сразу из кэша, затем с сервера
+        self.model.clear()
+        self.model.append_contacts(cache.load_contacts(self.login))
+        self.sync_contacts()
 
-        answer = send_to_server(f'get_contacts {current_login}')
+    def refresh_if_stale(self): # при повторном показе окна обновляемся, только если данные устарели
+        if time.monotonic() - self.synced_at > REFRESH_AFTER:
+            self.sync_contacts()
 
-        if answer == 'no contacts':
+    def sync_contacts(self, then=None): # запрос свежих данных с сервера; then() - когда они попадут в список и кэш
+        if then:
+            self.after_sync.append(then)
+        if self.syncing: # предыдущая загрузка еще идет
+            return
+        self.syncing = True
+        self.synced_at = time.monotonic()
+
+        if client.supports('delta'): # сервер присылает только изменения с прошлой версии
+            version = cache.version(self.login, 'contacts')
+            client.get_contacts_since(self.login, version, lambda delta: self.on_contacts_delta(delta, not version))
+        elif client.supports('paging'): # сервер умеет отдавать контакты страницами
+            self.request_contacts_page(0)
+        else:
+            client.get_contacts(self.login, self.on_contacts_loaded)
+
+    def on_contacts_delta(self, delta, full=False): # применяем изменения к списку и кэшу
+        if not not_loaded(delta):
+            if full: # изменения с нулевой версии - полный снимок, локальная копия заменяется
+                delta = (delta[0], True, delta[2])
+            self.model.apply_delta(*delta[1:])
+            cache.apply_contacts_delta(self.login, *delta)
+            if delta[1]:
+                self.reapply_unconfirmed()
+        self.finish_sync()
+
+    def request_contacts_page(self, offset): # запрос очередной страницы контактов
+        client.get_contacts_page(self.login, offset, CONTACTS_PAGE_SIZE, lambda page: self.on_contacts_page(offset, page))
+
+    def on_contacts_page(self, offset, page): # страница пришла: сразу просим следующую и показываем эту
+        if not_loaded(page): # сервер недоступен или отказал, остаемся с кэшем
+            self.finish_sync()
             return
 
-        contact_matrix = [[j for j in i.split(',')] for i in answer[:-1].split(';')]
-        for contact in contact_matrix:
-            contacts.append({ # добавление в список
-                'surname': contact[0],
-                'name': contact[1],
-                'patronymic': contact[2],
-                'birth_date': contact[3],
-                'city': contact[4],
-                'street': contact[5],
-                'house_number': contact[6],
-                'apartment_number': contact[7],
-                'phone': contact[8]
-            })
-
-            self.list_widget.addItem(QListWidgetItem(f"{contact[0]} {contact[1]} {contact[8]}")) # добавление отображения
+        full_page = len(page) == CONTACTS_PAGE_SIZE
+        if full_page:
+            self.request_contacts_page(offset + CONTACTS_PAGE_SIZE)
+        if offset == 0: # свежие данные заменяют показанные из кэша
+            self.model.clear()
+        self.model.append_contacts(page) # одна вставка строк на всю страницу
+        if not full_page:
+            cache.replace_contacts(self.login, self.model.all_contacts())
+            self.reapply_unconfirmed()
+            self.finish_sync()
+
+    def on_contacts_loaded(self, contacts): # контакты пришли
+        if not not_loaded(contacts):
+            self.model.clear()
+            self.model.append_contacts(contacts) # одна вставка строк на весь ответ
+            cache.replace_contacts(self.login, self.model.all_contacts())
+            self.reapply_unconfirmed()
+        self.finish_sync()
+
+    def reapply_unconfirmed(self): # список заменен данными сервера: поверх - изменения, которых сервер еще не подтвердил
+        for mutation in mutations.unconfirmed(self):
+            if mutation.old is not None and (mutation.new is None or mutation.new.phone != mutation.old.phone):
+                self.model.replace_contact(mutation.old.phone, None)
+            if mutation.new is not None:
+                self.model.replace_contact(mutation.new.phone, mutation.new)
+
+    def finish_sync(self): # загрузка закончилась: слова для поиска раскладываются, пока пользователь не начал печатать
+        self.syncing = False
+        QTimer.singleShot(0, self.sort_words_step)
+        callbacks, self.after_sync = self.after_sync, []
+        for callback in callbacks:
+            callback()
+
+    def sort_words_step(self): # по куску за раз: между кусками интерфейс успевает обработать ввод
+        if not self.model.contact_index.sort_words(SORT_CHUNK):
+            QTimer.singleShot(0, self.sort_words_step)
 
     def initUI(self): # отрисовка интерфейса
         self.setWindowTitle('Contacts')
 
-        self.list_widget = QListWidget(self)
-        self.list_widget.itemDoubleClicked.connect(self.change_contact)
+        self.model = ContactsModel(self)
+        self.search_input = QLineEdit(self)
+        self.search_input.setPlaceholderText('Поиск: фамилия, имя, отчество или часть номера')
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.textChanged.connect(self.model.set_filter) # результат обновляется на каждое нажатие клавиши
+        self.list_view = QListView(self)
+        self.list_view.setUniformItemSizes(True) # высота строк одинакова, виджет не измеряет каждую
+        self.list_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.list_view.setModel(self.model)
+        self.list_view.doubleClicked.connect(self.change_contact)
 
         self.add_button = QPushButton('Добавить', self)
         self.remove_button = QPushButton('Удалить', self)
         self.events_button = QPushButton('Мероприятия', self)
         self.change_password_button = QPushButton('Сменить пароль', self)
+        self.import_button = QPushButton('Импорт', self)
+        self.export_button = QPushButton('Экспорт', self)
         self.logout_button = QPushButton('Выйти', self)
 
         layout = QVBoxLayout()
-        layout.addWidget(self.list_widget)
+        layout.addWidget(self.search_input)
+        layout.addWidget(self.list_view)
 
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.add_button)
@@ -458,6 +877,8 @@ class ContactsWindow(QWidget): # окно контактов
         layout.addLayout(button_layout)
 
         logout_layout = QHBoxLayout()
+        logout_layout.addWidget(self.import_button)
+        logout_layout.addWidget(self.export_button)
         logout_layout.addStretch()
         logout_layout.addWidget(self.logout_button)
 
@@ -466,64 +887,171 @@ class ContactsWindow(QWidget): # окно контактов
         self.setLayout(layout)
         self.setStyleSheet(self.get_stylesheet()) # подключение стиля
 
+        self.import_button.clicked.connect(self.import_contacts)
+        self.export_button.clicked.connect(self.export_contacts)
         self.add_button.clicked.connect(self.add_contact)
         self.remove_button.clicked.connect(self.remove_contact)
         self.events_button.clicked.connect(self.switch_to_events)
         self.change_password_button.clicked.connect(self.switch_to_main)
         self.logout_button.clicked.connect(self.logout)
 
-    def add_contact(self): # добавление контакта
-        global contacts, current_login
-        dialog = AddContactDialog(self) # создаем окно добавление контакта
-        if dialog.exec_():
-            contact = dialog.get_contact() # считывание данных с формы
-            if contact:
-                request = f'add_contact {current_login} '
-                for i in contact.values():
-                    request += i + ' '
+    def add_contact(self, contact=None): # добавление контакта, contact - данные для повторного открытия формы
+        dialog = AddContactDialog(self, self.model.contact_index, contact) # создаем окно добавление контакта
+        if dialog.exec_(): # форма закрывается только без ошибок и без повтора известного номера
+            contact = Contact.from_dict(dialog.get_contact()) # считывание данных с формы
+            self.model.add_contact(contact) # контакт виден сразу, сервер получит его в фоне
+            mutations.enqueue(self, 'add', None, contact)
 
-                answer = send_to_server(request.strip())
+    def remove_contact(self): # удаление выбранных контактов
+        rows = [index.row() for index in self.list_view.selectionModel().selectedRows()]
+        if not rows:
+            return
+        contacts = [self.model.contact(row) for row in rows]
+        self.model.remove_rows(rows)
+        for contact in contacts: # при поддержке пакетов очередь отправит их одним запросом
+            mutations.enqueue(self, 'remove', contact)
+
+    def import_contacts(self): # импорт контактов из CSV или vCard
+        path, _ = QFileDialog.getOpenFileName(self, 'Импорт контактов', '', 'Контакты (*.csv *.vcf *.vcard)')
+        if not path:
+            return
 
-                if answer == 'contact with this phone number is already exists': # нельзя добавить контакт с уже существующим номером
-                    QMessageBox.warning(self, 'Ошибка контакта', 'Контакт с таким номером уже существует')
-                    return
+        self.importer = ContactImporter(path, self.model.contact_index.contacts)
+        self.imported = set() # контакты из файла: отказы по ним идут в итог импорта, а не отдельными сообщениями
+        self.import_added = 0
+        self.import_rejected = 0
+        self.import_journaled = 0
+        self.import_progress = QProgressDialog('Импорт контактов...', 'Отмена', 0, 1000, self)
+        self.import_progress.setWindowModality(Qt.WindowModal)
+        self.import_progress.setMinimumDuration(0)
+        self.upload_next_batch()
+
+    def upload_next_batch(self): # следующая пачка читается, когда очередь записи разобрала предыдущую
+        self.import_progress.setValue(int(self.importer.progress() * 1000))
+        if self.import_progress.wasCanceled(): # уже поставленные в очередь контакты все равно будут отправлены
+            mutations.when_idle(self.finish_import)
+            return
 
-                contacts.append(contact) # добавляем контакт
-                self.list_widget.addItem(QListWidgetItem(f"{contact['surname']} {contact['name']} {contact['phone']}")) # отображаем
-            else:
-                self.add_contact()
+        batch = self.importer.next_batch()
+        if not batch:
+            if self.importer.done:
+                mutations.when_idle(self.finish_import)
+            else: # вся пачка отбракована, читаем дальше, не блокируя интерфейс
+                QTimer.singleShot(0, self.upload_next_batch)
+            return
 
-    def remove_contact(self): # удаление контакта
-        global contacts, current_login
-        selected_items = self.list_widget.selectedItems() # берем выбранный элемент
-        if not selected_items:
+        contacts = [Contact.from_dict(contact) for contact in batch]
+        self.model.append_contacts(contacts) # как при добавлении вручную: видны сразу, без связи уходят в журнал и кэш
+        self.imported.update(contacts)
+        self.import_added += len(contacts)
+        for contact in contacts: # очередь отправит их пакетами
+            mutations.enqueue(self, 'add', None, contact)
+        mutations.when_idle(lambda: QTimer.singleShot(0, self.upload_next_batch))
+
+    def finish_import(self): # итог импорта
+        importer = self.importer
+        importer.close()
+        self.import_progress.close()
+        self.imported = set()
+        if client.online: # принятые сервером контакты попадают в кэш со следующей синхронизацией
+            self.sync_contacts()
+
+        report = f'Добавлено: {self.import_added - self.import_rejected - self.import_journaled}\n'
+        if self.import_journaled:
+            report += f'Нет связи, будут отправлены позже: {self.import_journaled}\n'
+        report += (f'Повторы номеров: {importer.duplicates}\n'
+                   f'С ошибками: {importer.invalid}\nОтклонено сервером: {self.import_rejected}')
+        for row, errors in importer.errors[:5]:
+            report += f'\nСтрока {row}: ' + '; '.join(message.split('\n')[0] for title, message in errors.values())
+        QMessageBox.information(self, 'Импорт контактов', report)
+
+    def export_contacts(self): # выгрузка всех контактов в CSV или JSON
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт контактов', 'contacts.csv', 'CSV (*.csv);;JSON (*.json)')
+        if not path:
+            return
+        export = open_export(self, path, CONTACT_FIELDS)
+        if not export:
             return
-        for item in selected_items:
-            index = self.list_widget.row(item)
-            self.list_widget.takeItem(index)
+        mutations.when_idle(lambda: self.start_export(export)) # сначала на сервер уходят изменения, которые еще в очереди
 
-            request = f"remove_contact {current_login} {contacts[index]['phone']}" # удаляем контакт
-            send_to_server(request)
+    def start_export(self, export): # очередь пуста: сервер знает все, что показано в списке
+        if client.supports('paging') and not client.supports('delta'): # кэш мог устареть, пишем страницы прямо с сервера
+            self.request_export_page(export, 0)
+        else: # кэш сначала догоняет сервер, в том числе импортированные контакты; без связи - как есть
+            self.sync_contacts(lambda: continue_export(self, export, cache.iter_contact_rows(self.login)))
 
-            del contacts[index]
+    def request_export_page(self, export, offset):
+        client.get_contacts_page(self.login, offset, CONTACTS_PAGE_SIZE, lambda page: self.on_export_page(export, offset, page))
 
-    def change_contact(self, item): # изменить контакт
-        global contacts
-        index = self.list_widget.row(item)
-        contact = contacts[index]
-        dialog = EditContactDialog(contact, self) # выводим окно изменения контакта
+    def on_export_page(self, export, offset, page): # страница сразу пишется в файл, в список она не попадает
+        if page is None or refused(page):
+            export.close()
+            QMessageBox.warning(self, 'Экспорт', f'{lost_reason(page)}, файл выгружен не полностью')
+            return
+        if len(page) == CONTACTS_PAGE_SIZE:
+            self.request_export_page(export, offset + CONTACTS_PAGE_SIZE)
+        export.write([contact.fields() for contact in page])
+        if len(page) < CONTACTS_PAGE_SIZE:
+            finish_export(self, export)
+
+    def change_contact(self, index): # изменить контакт
+        row = index.row()
+        contact = self.model.contact(row)
+        dialog = EditContactDialog(contact.as_dict(), self, self.model.contact_index) # выводим окно изменения контакта
         if dialog.exec_():
             updated_contact = dialog.get_contact()
             if updated_contact:
-                request = f"change_contact {current_login} {contacts[index]['phone']} "
-                contacts[index] = updated_contact
-                for i in updated_contact.values():
-                    request += i + ' '
-
-                send_to_server(request.strip()) # отправляем запрос на изменение
-
-                QMessageBox.information(self, 'Изменение контакта', f'Контакт успешно изменен') # оповещение
-                item.setText(f"{updated_contact['surname']} {updated_contact['name']} {updated_contact['phone']}")
+                updated_contact = Contact.from_dict(updated_contact)
+                self.model.update_row(row, updated_contact)
+                mutations.enqueue(self, 'change', contact, updated_contact)
+
+    # изменения контактов для очереди отложенной записи
+    def mutation_key(self, contact):
+        return normalize_phone(contact.phone)
+
+    def mutation_command(self, mutation):
+        return contact_command(self.login, mutation.op, mutation.old, mutation.new)
+
+    def mutation_batchable(self, first, mutation): # изменения по одному, добавления и удаления - пакетом
+        return client.supports('batch') and first.op != 'change'
+
+    def mutation_batch_command(self, group):
+        op = group[0].op
+        return contacts_batch_command(self.login, op, [m.new if op == 'add' else m.old for m in group])
+
+    def mutation_journaled(self, mutation): # без связи изменение попадает и в локальную копию
+        if mutation.new in self.imported:
+            self.import_journaled += 1
+        changes = []
+        if mutation.old is not None:
+            changes.append(('-', mutation.old.phone))
+        if mutation.new is not None:
+            changes.append(('+', mutation.new))
+        cache.apply_contacts_delta(self.login, cache.version(self.login, 'contacts'), False, changes)
+
+    def mutation_rollback(self, mutation): # вернуть в списке то, что было до изменения
+        self.model.replace_contact(mutation.new.phone if mutation.new else None, mutation.old)
+
+    def mutation_rejected(self, rejected): # [(изменение, ответ сервера)] - уже откачены
+        if self.imported: # импортированные контакты считаются в итоге импорта
+            self.import_rejected += sum(mutation.new in self.imported for mutation, answer in rejected)
+            rejected = [(mutation, answer) for mutation, answer in rejected if mutation.new not in self.imported]
+            if not rejected:
+                return
+        if len(rejected) == 1 and rejected[0][1] == DUPLICATE_CONTACT:
+            mutation = rejected[0][0]
+            if mutation.op == 'add': # номер есть на сервере, но еще не в нашем списке
+                QMessageBox.warning(self, *DUPLICATE_PHONE)
+                self.sync_contacts()
+                self.add_contact(mutation.new.as_dict()) # введенные данные не теряются
+                return
+        if rejected[0][1] is None:
+            reason = 'Нет связи с сервером'
+        else:
+            reason = 'Сервер отклонил изменения'
+        contacts = [mutation.new or mutation.old for mutation, answer in rejected]
+        QMessageBox.warning(self, 'Изменения отменены', f'{reason}, отменено изменений: {len(rejected)}\n'
+                            + '\n'.join(f'{c.surname} {c.name} {c.phone}' for c in contacts[:10]))
 
     def logout(self): # выход из аккаунта
         reply = QMessageBox.question(self, 'Выход', 'Вы уверены, что хотите выйти?',
@@ -539,19 +1067,26 @@ class ContactsWindow(QWidget): # окно контактов
                 font-size: 14px;
                 color: black;
             }
-            QListWidget {
+            QLineEdit {
+                padding: 10px;
+                border: 1px solid #ccc;
+                border-radius: 5px;
+                background-color: #ffffff;
+                color: black;
+            }
+            QListView {
                 border: 1px solid #ccc;
                 border-radius: 5px;
                 background-color: #ffffff;
                 padding: 10px;
                 color: black;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 5px;
                 border-bottom: 1px solid #ddd;
                 color: black;
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #007BFF;
                 color: white;
             }
@@ -569,46 +1104,64 @@ class ContactsWindow(QWidget): # окно контактов
             }
         """
 
-class PhoneInput(QLineEdit): # поле ввода номера телефона
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setInputMask("+00000000000;_") # маска
-
-def check_contact(self): # проверка полей контакта на соответствие формату
-    if check_sql_injection(self.surname_entry.text(), 'word'):
-        QMessageBox.warning(self, 'Ошибка фамилии', 'Фамилия - одно слово')
-        return None
+EXPORT_BATCH_SIZE = 5000 # столько строк кэша пишется в файл между событиями интерфейса
 
-    if check_sql_injection(self.name_entry.text(), 'word'):
-        QMessageBox.warning(self, 'Ошибка имени', 'Имя - одно слово')
+def open_export(parent, path, fields): # файл экспорта или None с сообщением об ошибке
+    try:
+        return ExportFile(path, fields)
+    except (OSError, ValueError) as e:
+        QMessageBox.warning(parent, 'Экспорт', f'Не удалось создать файл: {e}')
         return None
 
-    if check_sql_injection(self.patronymic_entry.text(), 'word'):
-        QMessageBox.warning(self, 'Ошибка отчества', 'Отчество - одно слово')
-        return None
+def continue_export(parent, export, rows): # выгрузка курсора кэша кусками, интерфейс не замирает
+    batch = rows.fetchmany(EXPORT_BATCH_SIZE)
+    export.write(batch)
+    if len(batch) == EXPORT_BATCH_SIZE:
+        QTimer.singleShot(0, lambda: continue_export(parent, export, rows))
+    else:
+        finish_export(parent, export)
 
-    if check_sql_injection(self.city_entry.text(), 'word'):
-        QMessageBox.warning(self, 'Ошибка города', 'Город - одно слово\nЕсли ваш город имеет в названии более одного слова -> разделите их символом \'-\'')
-        return None
+def finish_export(parent, export):
+    export.close()
+    QMessageBox.information(parent, 'Экспорт', f'Выгружено записей: {export.rows}')
 
-    if check_sql_injection(self.street_entry.text(), 'word'):
-        QMessageBox.warning(self, 'Ошибка улицы', 'Улица - одно слово\nЕсли ваша улица имеет в названии более одного слова -> разделите их символом \'-\'')
-        return None
+class PhoneInput(QLineEdit): # поле ввода номера телефона
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setInputMask("+00000000000;_") # маска
 
-    if check_sql_injection(self.house_number_entry.text(), 'number+word'):
-        QMessageBox.warning(self, 'Ошибка номера дома', 'Номер дома может быть только число+буква')
-        return None
+class ContactFormDialog(QDialog): # общее у окон добавления и изменения контакта: поля *_entry создает initUI наследника
+    def read_contact_form(self): # значения полей формы контакта как есть
+        return {
+            'surname': self.surname_entry.text(),
+            'name': self.name_entry.text(),
+            'patronymic': self.patronymic_entry.text(),
+            'birth_date': self.birth_date_entry.date().toString('yyyy-MM-dd'),
+            'city': self.city_entry.text(),
+            'street': self.street_entry.text(),
+            'house_number': self.house_number_entry.text(),
+            'apartment_number': self.apartment_number_entry.text(),
+            'phone': self.phone_entry.text()
+        }
 
-    if check_sql_injection(self.apartment_number_entry.text(), 'number'):
-        QMessageBox.warning(self, 'Ошибка номера квартиры', 'Номер квартиры это число')
-        return None
+    def fill_contact_form(self, contact): # заполнение формы контакта, обратное read_contact_form
+        for field in CONTACT_FIELDS:
+            if field == 'birth_date':
+                self.birth_date_entry.setDate(QDate.fromString(contact[field], 'yyyy-MM-dd'))
+            else:
+                getattr(self, f'{field}_entry').setText(contact[field])
 
-    return 'ok'
+    def warn_contact_errors(self, errors): # одно сообщение о первой ошибке формы
+        title, message = next(iter(errors.values()))
+        QMessageBox.warning(self, title, message)
 
-class AddContactDialog(QDialog): # окно добавления контакта
-    def __init__(self, parent=None):
+class AddContactDialog(ContactFormDialog): # окно добавления контакта
+    def __init__(self, parent=None, phones=(), contact=None):
         super().__init__(parent)
+        self.phones = phones # номера уже известных контактов, повтор виден до отправки на сервер
         self.initUI()
+        if contact:
+            self.fill_contact_form(contact)
 
     def initUI(self): # отрисовка интерфейса
         self.setWindowTitle('Add Contact')
@@ -650,53 +1203,38 @@ class AddContactDialog(QDialog): # окно добавления контакт
 
         self.phone_label = QLabel('Номер телефона:*', self)
         self.phone_entry = PhoneInput(self)
+        self.phone_entry.textChanged.connect(self.check_phone)
         self.form_layout.addRow(self.phone_label, self.phone_entry)
 
+        self.error_label = QLabel('', self) # повтор номера показывается сразу при вводе
+        self.error_label.setStyleSheet('color: #c00000;')
+
         self.button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         self.button_box.accepted.connect(self.accept)
         self.button_box.rejected.connect(self.reject)
 
         layout = QVBoxLayout()
         layout.addLayout(self.form_layout)
+        layout.addWidget(self.error_label)
         layout.addWidget(self.button_box)
 
         self.setLayout(layout)
         self.setStyleSheet(self.get_stylesheet()) # подключение стиля
 
-    def get_contact(self): # получение контакта из формы
-        last_name = self.surname_entry.text()
-        first_name = self.name_entry.text()
-        phone = self.phone_entry.text()
-
-        if not last_name or not first_name or not phone:
-            QMessageBox.warning(self, 'Ошибка ввода', 'Заполните все поля')
-            return None
-
-        if not(check_contact(self)):
-            return None
-
-        if (len(last_name) > 64 or len(first_name) > 64 or len(self.patronymic_entry.text()) > 64 or
-                len(self.city_entry.text()) > 64 or len(self.street_entry.text()) > 64 or
-                len(self.house_number_entry.text()) > 64 or len(self.apartment_number_entry.text()) > 64): # проверка длины
-            QMessageBox.warning(self, 'Ошибка ввода', 'Слишком много данных на 1 поле, максимальная длина - 64 символа')
-            return None
+    def check_phone(self, phone): # проверка номера по локальному индексу на каждое нажатие клавиши
+        duplicate = phone in self.phones
+        self.error_label.setText(DUPLICATE_PHONE[1] if duplicate else '')
+        self.button_box.button(QDialogButtonBox.Ok).setEnabled(not duplicate)
 
+    def accept(self): # форма с ошибками не закрывается, чтобы не потерять введенное
+        errors = validate_contact(self.read_contact_form(), self.phones) # обязательные поля, символы, длина и повтор номера
+        if errors:
+            self.warn_contact_errors(errors)
+            return
+        super().accept()
 
-        if len(phone) != 12:
-            QMessageBox.warning(self, 'Phone Error', 'Длина номера телефона - 11 символов')
-            return None
-
-        return {
-            'surname': last_name.capitalize(),
-            'name': first_name.capitalize(),
-            'patronymic': self.patronymic_entry.text().capitalize(),
-            'birth_date': self.birth_date_entry.date().toString('yyyy-MM-dd'),
-            'city': self.city_entry.text(),
-            'street': self.street_entry.text(),
-            'house_number': self.house_number_entry.text(),
-            'apartment_number': self.apartment_number_entry.text(),
-            'phone': phone
-        }
+    def get_contact(self): # получение контакта из формы
+        return normalize_contact(self.read_contact_form())
 
     def get_stylesheet(self): # стиль
         return """
@@ -730,11 +1268,12 @@ class AddContactDialog(QDialog): # окно добавления контакт
             }
         """
 
-class EditContactDialog(QDialog): # окно изменение контакта
-    def __init__(self, contact, parent=None):
+class EditContactDialog(ContactFormDialog): # окно изменение контакта
+    def __init__(self, contact, parent=None, phones=()):
         super().__init__(parent)
         self.contact = contact
         self.original_contact = contact.copy()
+        self.phones = phones # номера остальных контактов: менять номер на чужой нельзя
         self.initUI()
 
     def initUI(self): # отрисовка интерфейса
@@ -798,6 +1337,9 @@ class EditContactDialog(QDialog): # окно изменение контакта
         self.phone_entry.textChanged.connect(self.check_changes)
         self.form_layout.addRow(self.phone_label, self.phone_entry)
 
+        self.error_label = QLabel('', self) # первая ошибка в форме, обновляется при вводе
+        self.error_label.setStyleSheet('color: #c00000;')
+
         self.button_box = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Cancel)
         self.button_box.button(QDialogButtonBox.Save).setEnabled(False)
         self.button_box.accepted.connect(self.save_contact)
@@ -805,49 +1347,36 @@ class EditContactDialog(QDialog): # окно изменение контакта
 
         layout = QVBoxLayout()
         layout.addLayout(self.form_layout)
+        layout.addWidget(self.error_label)
         layout.addWidget(self.button_box)
 
         self.setLayout(layout)
         self.setStyleSheet(self.get_stylesheet()) # подключение стиля
 
-    def check_changes(self): # проверка изменений
-        current_contact = self.get_contact()
-        if current_contact != self.original_contact:
-            self.button_box.button(QDialogButtonBox.Save).setEnabled(True)
-        else:
-            self.button_box.button(QDialogButtonBox.Save).setEnabled(False)
+    def check_changes(self): # проверка изменений на каждое нажатие клавиши, без всплывающих окон
+        current_contact = self.read_contact_form()
+        errors = self.validate(current_contact)
+        self.error_label.setText(next(iter(errors.values()))[1] if errors else '')
+        self.button_box.button(QDialogButtonBox.Save).setEnabled(not errors and current_contact != self.original_contact)
 
     def save_contact(self): # сохранение изменений
-        current_contact = self.get_contact()
+        current_contact = self.read_contact_form()
+        errors = self.validate(current_contact)
         if current_contact == self.original_contact:
             QMessageBox.warning(self, 'Нет изменений', 'Никаких изменений не произведено.')
-        elif not current_contact:
-            QMessageBox.warning(self, 'Ошибка ввода', 'Заполните или исправьте все поля')
+        elif errors:
+            self.warn_contact_errors(errors)
         else:
             self.accept()
 
-    def get_contact(self): # получение контакта из формы
-        surname = self.surname_entry.text()
-        name = self.name_entry.text()
-        phone = self.phone_entry.text()
-
-        if not (surname and name and phone):
-            return None
+    def validate(self, contact):
+        return validate_contact(contact, self.phones, normalize_phone(self.original_contact['phone']))
 
-        if not(check_contact(self)):
+    def get_contact(self): # получение контакта из формы
+        contact = self.read_contact_form()
+        if self.validate(contact):
             return None
-
-        return {
-            'surname': surname,
-            'name': name,
-            'patronymic': self.patronymic_entry.text(),
-            'birth_date': self.birth_date_entry.date().toString('yyyy-MM-dd'),
-            'city': self.city_entry.text(),
-            'street': self.street_entry.text(),
-            'house_number': self.house_number_entry.text(),
-            'apartment_number': self.apartment_number_entry.text(),
-            'phone': phone
-        }
+        return contact
 
     def get_stylesheet(self): # стиль
         return """
@@ -881,12 +1410,45 @@ class EditContactDialog(QDialog): # окно изменение контакта
             }
         """
 
+MONTH_CACHE_SIZE = 12 # сколько месяцев календарь держит в памяти
+
+def events_by_date(events): # [(дата 'yyyy-MM-dd', название)] -> {QDate: [названия]}, каждая дата разбирается один раз
+    dates = {}
+    for date_str, name in events:
+        dates.setdefault(date_str, []).append(name)
+    mapping = {}
+    for date_str, names in dates.items():
+        date = QDate.fromString(date_str, 'yyyy-MM-dd')
+        if date.isValid():
+            mapping[date] = names
+    return mapping
+
+def month_range(year, month): # первый и последний день месяца в формате протокола
+    return f'{year:04d}-{month:02d}-01', f'{year:04d}-{month:02d}-{monthrange(year, month)[1]:02d}'
+
+EXPORT_YEARS = (1900, 2100) # выгрузка с сервера идет по году на запрос, события вне этих лет - двумя крайними кусками
+EXPORT_AHEAD = 8 # столько запросов выгрузки отправлено заранее, в файл куски все равно пишутся по порядку
+
+def export_ranges(): # диапазоны дат, вместе покрывающие все даты 'yyyy-MM-dd', по возрастанию
+    first_year, last_year = EXPORT_YEARS
+    ranges = [('0000-01-01', f'{first_year - 1:04d}-12-31')]
+    ranges.extend((f'{year:04d}-01-01', f'{year:04d}-12-31') for year in range(first_year, last_year + 1))
+    ranges.append((f'{last_year + 1:04d}-01-01', '9999-12-31'))
+    return ranges
+
 class EventsWindow(QWidget): # окно событий
     def __init__(self, switch_to_contacts, switch_to_main, switch_to_login):
         super().__init__()
         self.switch_to_contacts = switch_to_contacts
         self.switch_to_main = switch_to_main
         self.switch_to_login = switch_to_login
+        self.login = current_login # окно принадлежит сессии этого пользователя
+        self.syncing = False
+        self.synced_at = 0
+        self.after_sync = [] # что выполнить, когда текущая загрузка закончится
+        self.date_dialog = None # открытый список событий на дату, обновляется при откате изменений
+        self.months = OrderedDict() # (год, месяц) загруженных месяцев, от давно показанных к недавним
+        self.export = None # идущая выгрузка с сервера по диапазонам дат
         self.initUI()
         self.load_events()
 
@@ -896,9 +1458,11 @@ class EventsWindow(QWidget): # окно событий
         self.calendar = CustomCalendarWidget(self)
         self.calendar.setGridVisible(True)
         self.calendar.clicked.connect(self.show_events_for_date)
+        self.calendar.currentPageChanged.connect(self.show_page)
 
         self.contacts_button = QPushButton('Контакты', self)
         self.change_password_button = QPushButton('Сменить пароль', self)
+        self.export_button = QPushButton('Экспорт', self)
         self.logout_button = QPushButton('Выйти', self)
 
         layout = QVBoxLayout()
@@ -911,6 +1475,7 @@ class EventsWindow(QWidget): # окно событий
         layout.addLayout(button_layout)
 
         logout_layout = QHBoxLayout()
+        logout_layout.addWidget(self.export_button)
         logout_layout.addStretch()
         logout_layout.addWidget(self.logout_button)
 
@@ -919,30 +1484,230 @@ class EventsWindow(QWidget): # окно событий
         self.setLayout(layout)
         self.setStyleSheet(self.get_stylesheet()) # подключение стиля
 
+        self.export_button.clicked.connect(self.export_events)
         self.contacts_button.clicked.connect(self.switch_to_contacts)
         self.change_password_button.clicked.connect(self.switch_to_main)
         self.logout_button.clicked.connect(self.logout)
 
-    def load_events(self): # загрузка событий из бд
-        global current_login
-        answer = send_to_server(f"get_events {current_login}")
+    def load_events(self): # загрузка событий: сразу из кэша, затем с сервера
+        self.calendar.clearEvents()
+        self.months.clear()
+        if not self.windowed(): # старый сервер отдает только все события сразу
+            self.show_events(cache.load_events(self.login))
+            self.sync_events()
+            return
+        self.show_page(self.calendar.yearShown(), self.calendar.monthShown())
+        if self.ranged(): # месяцы запрашиваются с сервера по мере показа
+            self.synced_at = time.monotonic()
+        else:
+            self.sync_events()
 
-        if answer == "no events":
+    def windowed(self): # календарь держит только показанные месяцы
+        return client.supports('delta') or client.supports('range')
+
+    def ranged(self): # с сервера загружаются отдельные месяцы, а не все события
+        return client.supports('range') and not client.supports('delta')
+
+    def show_page(self, year, month): # показан другой месяц: он и соседние берутся из кэша окна, недостающие загружаются
+        if not self.windowed():
             return
+        self.load_month(year, month)
+        first = QDate(year, month, 1)
+        for neighbour in (first.addMonths(1), first.addMonths(-1)): # соседние месяцы заранее, листание будет мгновенным
+            QTimer.singleShot(0, lambda date=neighbour: self.load_month(date.year(), date.month()))
+
+    def load_month(self, year, month):
+        key = (year, month)
+        if key in self.months:
+            self.months.move_to_end(key)
+            return
+        self.months[key] = None
+        if len(self.months) > MONTH_CACHE_SIZE:
+            self.calendar.clearMonth(*self.months.popitem(last=False)[0])
+
+        first, last = month_range(year, month)
+        self.show_events(cache.load_events_range(self.login, first, last)) # при загрузке с сервера - прошлые данные до ответа
+        if self.ranged():
+            self.request_month(year, month)
 
-        event_matrix = [[j for j in i.split(',')[:-1]] for i in answer[:-1].split(';')]
-        for event in event_matrix:
-            if len(event) >= 2:
-                date_str = event[0]
-                events = event[1:]
-                date = QDate.fromString(date_str, 'yyyy-MM-dd')
-                if date.isValid():
-                    for i in events:
-                        self.calendar.setEvent(date, ' '.join(i.split('_')))
+    def request_month(self, year, month):
+        first, last = month_range(year, month)
+        client.get_events(self.login, first, last, lambda events: self.on_month_loaded(year, month, events))
+
+    def on_month_loaded(self, year, month, events): # свежие события месяца заменяют показанные из кэша
+        if not_loaded(events) or (year, month) not in self.months: # сервер недоступен или месяц уже вытеснен
+            return
+        first, last = month_range(year, month)
+        self.calendar.setMonthEvents(year, month, events_by_date(self.with_unconfirmed(events, first, last)))
+        cache.replace_events_range(self.login, first, last, events)
+        self.refresh_date_dialog()
+
+    def reload_months(self): # перечитать показанные месяцы из кэша после полной замены данных
+        events = []
+        for year, month in self.months:
+            first, last = month_range(year, month)
+            events.extend(self.with_unconfirmed(cache.load_events_range(self.login, first, last), first, last))
+        self.calendar.setEvents(events_by_date(events))
+        self.refresh_date_dialog()
+
+    def with_unconfirmed(self, events, first='0000-00-00', last='9999-99-99'): # события дат с first по last и поверх них изменения, которых сервер еще не подтвердил
+        events = list(events)
+        for mutation in mutations.unconfirmed(self):
+            if mutation.old is not None and first <= mutation.old[0] <= last and mutation.old in events:
+                events.remove(mutation.old)
+            if mutation.new is not None and first <= mutation.new[0] <= last:
+                events.append(mutation.new)
+        return events
+
+    def refresh_date_dialog(self):
+        if self.date_dialog is not None:
+            self.date_dialog.refresh()
+
+    def refresh_if_stale(self): # при повторном показе окна обновляемся, только если данные устарели
+        if time.monotonic() - self.synced_at > REFRESH_AFTER:
+            self.sync_events()
+
+    def sync_events(self, then=None): # запрос свежих данных с сервера; then() - когда они попадут в календарь и кэш
+        if then:
+            self.after_sync.append(then)
+        if self.syncing:
+            return
+        self.syncing = True
+        self.synced_at = time.monotonic()
+
+        if client.supports('delta'):
+            version = cache.version(self.login, 'events')
+            client.get_events_since(self.login, version, lambda delta: self.on_events_delta(delta, not version))
+        elif client.supports('range'): # обновляем только загруженные месяцы
+            self.finish_sync()
+            for year, month in self.months:
+                self.request_month(year, month)
+        else:
+            client.get_events(self.login, callback=self.on_events_loaded)
+
+    def show_events(self, events): # добавление событий [(дата, название)] в календарь одной перерисовкой
+        self.calendar.addEvents(events_by_date(events))
+
+    def on_events_loaded(self, events): # события пришли
+        if not not_loaded(events):
+            self.calendar.setEvents(events_by_date(self.with_unconfirmed(events)))
+            cache.replace_events(self.login, events)
+            self.refresh_date_dialog()
+        self.finish_sync()
+
+    def finish_sync(self):
+        self.syncing = False
+        callbacks, self.after_sync = self.after_sync, []
+        for callback in callbacks:
+            callback()
+
+    def on_events_delta(self, delta, full=False):
+        if not not_loaded(delta):
+            self.apply_events_delta(delta, full)
+        self.finish_sync()
+
+    def apply_events_delta(self, delta, full): # применяем изменения к календарю и кэшу
+        if full: # изменения с нулевой версии - полный снимок, локальная копия заменяется
+            delta = (delta[0], True, delta[2])
+
+        cache.apply_events_delta(self.login, *delta)
+        version, reset, changes = delta
+        if reset:
+            self.reload_months()
+            return
+        # в изменениях есть и свои, уже показанные в календаре: затронутые дни не дополняются, а перечитываются из кэша
+        days = {}
+        for date_str in {date_str for operation, date_str, name in changes}:
+            date = QDate.fromString(date_str, 'yyyy-MM-dd')
+            if (date.year(), date.month()) not in self.months: # месяц не показан, прочитается из кэша при показе
+                continue
+            events = self.with_unconfirmed(cache.load_events_range(self.login, date_str, date_str), date_str, date_str)
+            days[date] = [name for day, name in events]
+        if days:
+            self.calendar.setDaysEvents(days)
+            self.refresh_date_dialog()
+
+    def export_events(self): # выгрузка событий из кэша в CSV, JSON или iCalendar
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт событий', 'events.ics', 'iCalendar (*.ics);;CSV (*.csv);;JSON (*.json)')
+        if not path:
+            return
+        export = open_export(self, path, EVENT_FIELDS)
+        if not export:
+            return
+        mutations.when_idle(lambda: self.start_export(export)) # сначала на сервер уходят изменения, которые еще в очереди
+
+    def start_export(self, export):
+        if self.ranged(): # в кэше только просмотренные месяцы: события берутся с сервера по годам и пишутся по мере прихода
+            self.export = export
+            self.export_ranges = export_ranges()
+            self.export_replies = {} # номер диапазона -> события, пришедшие раньше предыдущих
+            self.export_written = 0
+            for position in range(min(EXPORT_AHEAD, len(self.export_ranges))):
+                self.request_export_range(export, position)
+        else: # кэш сначала догоняет сервер; без связи - как есть
+            self.sync_events(lambda: continue_export(self, export, cache.iter_event_rows(self.login)))
+
+    def request_export_range(self, export, position):
+        first, last = self.export_ranges[position]
+        client.get_events(self.login, first, last, lambda events: self.on_export_range(export, position, events))
+
+    def on_export_range(self, export, position, events): # в памяти не больше EXPORT_AHEAD лет событий
+        if self.export is not export: # выгрузка уже прервана
+            return
+        if events is None or refused(events):
+            self.export = None
+            export.close()
+            QMessageBox.warning(self, 'Экспорт', f'{lost_reason(events)}, файл выгружен не полностью')
+            return
+        self.export_replies[position] = events
+        while self.export_written in self.export_replies:
+            export.write(self.export_replies.pop(self.export_written))
+            self.export_written += 1
+            following = self.export_written + EXPORT_AHEAD - 1
+            if following < len(self.export_ranges):
+                self.request_export_range(export, following)
+        if self.export_written == len(self.export_ranges):
+            self.export = None
+            finish_export(self, export)
 
     def show_events_for_date(self, date): # показать события на дату
-        dialog = EventListDialog(date, self.calendar, self) # создаем окно со списком событий
-        dialog.exec_()
+        self.date_dialog = EventListDialog(date, self.calendar, self) # создаем окно со списком событий
+        self.date_dialog.exec_()
+        self.date_dialog = None
+
+    # изменения событий для очереди отложенной записи: событие - (дата 'yyyy-MM-dd', название)
+    def mutation_key(self, event):
+        return event
+
+    def mutation_command(self, mutation):
+        return event_command(self.login, mutation.op, mutation.old, mutation.new)
+
+    def mutation_batchable(self, first, mutation): # пакетом удаляются только события одной даты
+        return client.supports('batch') and first.op == 'remove' and mutation.old[0] == first.old[0]
+
+    def mutation_batch_command(self, group):
+        return events_batch_command(self.login, group[0].old[0], [m.old[1] for m in group])
+
+    def mutation_journaled(self, mutation): # без связи изменение попадает и в локальную копию
+        changes = []
+        if mutation.old is not None:
+            changes.append(('-',) + mutation.old)
+        if mutation.new is not None:
+            changes.append(('+',) + mutation.new)
+        cache.apply_events_delta(self.login, cache.version(self.login, 'events'), False, changes)
+
+    def mutation_rollback(self, mutation): # вернуть в календаре то, что было до изменения
+        if mutation.new is not None:
+            self.calendar.removeEvent(QDate.fromString(mutation.new[0], 'yyyy-MM-dd'), mutation.new[1])
+        if mutation.old is not None:
+            self.calendar.setEvent(QDate.fromString(mutation.old[0], 'yyyy-MM-dd'), mutation.old[1])
+        self.refresh_date_dialog()
+
+    def mutation_rejected(self, rejected): # [(изменение, ответ сервера)] - уже откачены
+        reason = 'Нет связи с сервером' if rejected[0][1] is None else 'Сервер отклонил изменения'
+        events = [mutation.new or mutation.old for mutation, answer in rejected]
+        QMessageBox.warning(self, 'Изменения отменены', f'{reason}, отменено изменений: {len(rejected)}\n'
+                            + '\n'.join(f'{date} {name}' for date, name in events[:10]))
 
     def logout(self): # выйти из аккаунта
         reply = QMessageBox.question(self, 'Выход', 'Вы уверены, что хотите выйти?',
@@ -982,6 +1747,7 @@ class EventListDialog(QDialog): # список событий
         super().__init__(parent)
         self.date = date
         self.calendar = calendar
+        self.window = parent # окно событий: строит запросы и откатывает отклоненные изменения
         self.initUI()
 
     def initUI(self):
@@ -991,6 +1757,7 @@ class EventListDialog(QDialog): # список событий
         events = self.calendar.getEvents(self.date)
         for event in events:
             self.list_widget.addItem(QListWidgetItem(event))
+        self.list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.list_widget.itemDoubleClicked.connect(self.change_event)
 
         self.add_button = QPushButton('Добавить', self)
@@ -1014,6 +1781,11 @@ class EventListDialog(QDialog): # список событий
         self.remove_button.clicked.connect(self.remove_event)
         self.close_button.clicked.connect(self.close)
 
+    def refresh(self): # список заново из календаря, например после отката изменения
+        self.list_widget.clear()
+        for event in self.calendar.getEvents(self.date):
+            self.list_widget.addItem(QListWidgetItem(event))
+
     def change_event(self, item): # изменение события
         old_event_name = item.text()
         new_event_name, ok = QInputDialog.getText(self, 'Смена мероприятия', 'Введите название мероприятия:', text=old_event_name)
@@ -1022,12 +1794,12 @@ class EventListDialog(QDialog): # список событий
             QMessageBox.warning(self, 'Ошибка изменения', 'Вы можете писать только слова, числа и знаки :-_')
             return
 
-        if ok and new_event_name:
-            answer = send_to_server(f"change_event {current_login} {self.date.toString('yyyy-MM-dd')} {'_'.join(old_event_name.strip().split())} {'_'.join(new_event_name.strip().split())}")
-            if answer == "successful change_event": # успешное изменение
-                self.calendar.removeEvent(self.date, old_event_name)
-                self.calendar.setEvent(self.date, new_event_name)
-                item.setText(new_event_name)
+        if ok and new_event_name: # в календаре сразу, сервер получит изменение в фоне
+            self.calendar.removeEvent(self.date, old_event_name)
+            self.calendar.setEvent(self.date, new_event_name)
+            item.setText(new_event_name)
+            date = self.date.toString('yyyy-MM-dd')
+            mutations.enqueue(self.window, 'change', (date, old_event_name), (date, new_event_name))
 
     def add_event(self): # добавление события
         event_name, ok = QInputDialog.getText(self, 'Добавить', 'Введите название мероприятия:')
@@ -1041,21 +1813,21 @@ class EventListDialog(QDialog): # список событий
             return None
 
         if ok and event_name:
-            answer = send_to_server(f"add_event {current_login} {self.date.toString('yyyy-MM-dd')} {'_'.join(event_name.strip().split())}") # отправка запроса на добавление
-            if answer == "successful add_event":
-                self.list_widget.addItem(QListWidgetItem(event_name))
-                self.calendar.setEvent(self.date, event_name)
+            self.list_widget.addItem(QListWidgetItem(event_name))
+            self.calendar.setEvent(self.date, event_name)
+            mutations.enqueue(self.window, 'add', None, (self.date.toString('yyyy-MM-dd'), event_name))
 
     def remove_event(self): # удаление события
         selected_items = self.list_widget.selectedItems()
         if not selected_items: # если ничего не выбрано
             return
-        for item in selected_items:
+
+        date = self.date.toString('yyyy-MM-dd')
+        for item in selected_items: # при поддержке пакетов очередь отправит их одним запросом
             event_name = item.text()
-            answer = send_to_server(f"remove_event {current_login} {self.date.toString('yyyy-MM-dd')} {'_'.join(event_name.strip().split())}") # запрос на удаление
-            if answer == "successful remove_event":
-                self.calendar.removeEvent(self.date, event_name)
-                self.list_widget.takeItem(self.list_widget.row(item))
+            self.calendar.removeEvent(self.date, event_name)
+            self.list_widget.takeItem(self.list_widget.row(item))
+            mutations.enqueue(self.window, 'remove', (date, event_name))
 
     def get_stylesheet(self): # стиль
         return """
@@ -1095,6 +1867,127 @@ class EventListDialog(QDialog): # список событий
             }
         """
 
+class TelemetryPanel(QDialog): # скрытая панель отладки (Ctrl+Shift+D): счетчики сетевого слоя и разбора ответов
+    COMMAND_COLUMNS = ('Команда', 'Вызовы', 'Ошибки', 'Средн. мс', 'p50 мс', 'p95 мс', 'p99 мс', 'Макс. мс', 'Отправлено', 'Получено')
+    PARSE_COLUMNS = ('Разбор', 'Вызовы', 'Записей', 'Средн. мс', 'p50 мс', 'p95 мс', 'p99 мс', 'Макс. мс')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Телеметрия')
+        self.commands_table = self.create_table(self.COMMAND_COLUMNS)
+        self.parse_table = self.create_table(self.PARSE_COLUMNS)
+
+        self.dump_button = QPushButton('Сохранить JSON', self)
+        self.dump_button.clicked.connect(self.dump)
+        self.close_button = QPushButton('Закрыть', self)
+        self.close_button.clicked.connect(self.close)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.commands_table)
+        layout.addWidget(self.parse_table)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.dump_button)
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+        self.resize(900, 500)
+
+        self.timer = QTimer(self) # пока панель открыта, цифры обновляются раз в секунду
+        self.timer.timeout.connect(self.refresh)
+
+    def create_table(self, columns):
+        table = QTableWidget(0, len(columns), self)
+        table.setHorizontalHeaderLabels(columns)
+        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        return table
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(1000)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = telemetry.snapshot()
+        self.fill(self.commands_table, [
+            (verb, row['count'], row['failures'], row['avg_ms'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'],
+             format_size(row['bytes_sent']), format_size(row['bytes_received']))
+            for verb, row in snapshot['commands'].items()])
+        self.fill(self.parse_table, [
+            (name, row['count'], row['items'], row['avg_ms'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms'])
+            for name, row in snapshot['parsing'].items()])
+
+    def fill(self, table, rows):
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def dump(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Сохранить телеметрию', 'telemetry.json', 'JSON (*.json)')
+        if path:
+            telemetry.dump(path)
+
+def format_size(size): # байты -> '12.3 КБ'
+    for unit in ('Б', 'КБ', 'МБ'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'Б' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} ГБ'
+
+class DebugHotkey(QObject): # Ctrl+Shift+D в любом окне приложения открывает панель телеметрии
+    def __init__(self):
+        super().__init__()
+        self.panel = None
+
+    def eventFilter(self, watched, event):
+        if (event.type() == QEvent.KeyPress and event.key() == Qt.Key_D
+                and event.modifiers() == (Qt.ControlModifier | Qt.ShiftModifier)):
+            if self.panel is None:
+                self.panel = TelemetryPanel()
+            self.panel.show()
+            self.panel.raise_()
+            return True
+        return False
+
+HEARTBEAT_MS = 20 # как часто поток интерфейса отмечается для сторожа зависаний
+
+def start_watchdog(): # PEOPLEANDPLACES_STALL_MS=200 - искать зависания интерфейса дольше 200 мс
+    threshold = os.environ.get('PEOPLEANDPLACES_STALL_MS')
+    if not threshold:
+        return None
+    milliseconds = stall_threshold(threshold)
+    if milliseconds is None: # опечатка в переменной окружения не должна мешать запуску приложения
+        print(f"Ignoring PEOPLEANDPLACES_STALL_MS={threshold!r}: expected a positive number of milliseconds")
+        return None
+    watchdog = StallWatchdog(milliseconds / 1000)
+    heartbeat = QTimer(QApplication.instance()) # живет, пока живет приложение
+    heartbeat.timeout.connect(watchdog.beat)
+    heartbeat.start(HEARTBEAT_MS)
+    watchdog.start()
+    atexit.register(lambda: print(watchdog.report()))
+    return watchdog
+
+def stall_threshold(value): # '200', '200ms', '0.5' -> число миллисекунд; None, если это не положительное число
+    value = value.strip().lower()
+    if value.endswith('ms'):
+        value = value[:-2].strip()
+    try:
+        milliseconds = float(value)
+    except ValueError:
+        return None
+    return milliseconds if 0 < milliseconds < float('inf') else None
+
+def dump_telemetry(): # при выходе и по сигналу SIGUSR1; из обработчика сигнала пишет отдельный поток
+    try:
+        print(f'Telemetry saved to {telemetry.dump()}')
+    except OSError as e:
+        print(f'Telemetry not saved: {e}')
+
 login_window = None
 registration_window = None
 change_password_window = None
@@ -1103,77 +1996,116 @@ events_window = None
 
 def show_login_window(): # открыть окно авторизации
     global login_window
-    login_window = LoginWindow(switch_to_registration, switch_to_contacts)
-    login_window.resize(300, 300)
+    if login_window is None:
+        login_window = LoginWindow(switch_to_registration, switch_to_contacts)
+        login_window.resize(300, 300)
+    login_window.entry_password.clear()
     login_window.show()
 
 def show_registration_window(): # открыть окно регистрации
     global registration_window
-    registration_window = RegistrationWindow(switch_to_login)
-    registration_window.resize(300, 300)
+    if registration_window is None:
+        registration_window = RegistrationWindow(switch_to_login)
+        registration_window.resize(300, 300)
     registration_window.show()
 
 def show_change_password_window(): # открыть окно смены пароля
     global change_password_window
-    change_password_window = ChangePasswordWindow(switch_to_contacts, switch_to_events)
-    change_password_window.resize(300, 400)
+    if change_password_window is None:
+        change_password_window = ChangePasswordWindow(switch_to_contacts, switch_to_events)
+        change_password_window.resize(300, 400)
     change_password_window.show()
 
-def show_contacts_window(): # открыть окно контактов
+def show_contacts_window(): # открыть окно контактов (создается один раз за сессию)
     global contacts_window
-    contacts_window = ContactsWindow(switch_to_events, switch_to_change_password, switch_to_login)
-    contacts_window.resize(300, 400)
+    if contacts_window is None:
+        contacts_window = ContactsWindow(switch_to_events, switch_to_change_password, switch_to_login)
+        contacts_window.resize(300, 400)
+        if events_window is None: # события запрашиваются вместе с контактами, а не после них
+            create_events_window()
+    else:
+        contacts_window.refresh_if_stale()
     contacts_window.show()
 
-def show_events_window(): # открыть окно событий
+def create_events_window(): # окно событий создается скрытым и сразу начинает загрузку
     global events_window
     events_window = EventsWindow(switch_to_contacts, switch_to_change_password, switch_to_login)
     events_window.resize(300, 400)
+
+def show_events_window(): # открыть окно событий (создается один раз за сессию)
+    if events_window is None:
+        create_events_window()
+    else:
+        events_window.refresh_if_stale()
     events_window.show()
 
+def hide_windows(*windows): # окна не уничтожаются, а только скрываются до следующего показа
+    for window in windows:
+        if window:
+            window.hide()
+
+def end_session(): # выход из аккаунта: окна пользователя больше не нужны
+    global change_password_window, contacts_window, events_window, current_login, current_password
+    for window in (change_password_window, contacts_window, events_window):
+        if window:
+            window.close()
+    change_password_window = contacts_window = events_window = None
+    current_login = current_password = None
+
+def on_reconnected(answer=None): # связь восстановлена: вход подтверждается заново, затем журнал изменений и свежие данные
+    if current_login is None:
+        return
+    login = current_login
+    client.login(login, current_password, lambda answer: on_reauthenticated(login, answer))
+
+def on_reauthenticated(login, answer):
+    if login != current_login or answer is None: # сессия уже другая или связь снова потеряна
+        return
+    if answer != SUCCESSFUL_LOGIN: # вход без связи сервер не подтвердил: сделанное в нем не отправляется
+        dropped = mutations.journal.discard(login)
+        cache.forget_password(login)
+        cache.forget_versions(login)
+        QMessageBox.warning(QApplication.activeWindow(), 'Вход не подтвержден',
+                            f'Сервер не принял имя пользователя или пароль, изменения без связи отменены: {len(dropped)}')
+        switch_to_login()
+        return
+    if not mutations.replay(on_journal_replayed, login):
+        sync_windows()
+
+def on_journal_replayed(replayed, conflicts):
+    for login in {command.split()[1] for command in replayed}: # в локальной копии могли остаться отклоненные изменения
+        cache.forget_versions(login)
+    if conflicts:
+        QMessageBox.warning(QApplication.activeWindow(), 'Конфликты синхронизации',
+                            f'Сервер не принял изменений, сделанных без связи: {len(conflicts)}\n'
+                            + '\n'.join(f'{command} - {answer}' for command, answer in conflicts[:10]))
+    sync_windows()
+
+def sync_windows(): # открытые окна перезапрашивают данные
+    if contacts_window:
+        contacts_window.sync_contacts()
+    if events_window:
+        events_window.sync_events()
+
 def switch_to_registration(): # переключиться на регистрацию
-    global login_window, registration_window
-    if login_window:
-        login_window.close()
+    hide_windows(login_window)
     show_registration_window()
 
 def switch_to_login(): # переключиться на вход
-    global registration_window, login_window, contacts_window, events_window, contacts, current_login
-    if registration_window:
-        registration_window.close()
-    if contacts_window:
-        contacts, current_login = [], None
-        contacts_window.close()
-    if events_window:
-        contacts, current_login = [], None
-        events_window.close()
+    hide_windows(registration_window)
+    end_session()
     show_login_window()
 
 def switch_to_change_password(): # переключиться на смену пароля
-    global change_password_window, contacts_window, events_window
-
-    if contacts_window:
-        contacts_window.close()
-    if events_window:
-        events_window.close()
+    hide_windows(contacts_window, events_window)
     show_change_password_window()
 
 def switch_to_contacts(): # переключиться на окно контактов
-    global change_password_window, contacts_window, login_window
-    if change_password_window:
-        change_password_window.close()
-    if events_window:
-        events_window.close()
-    if login_window:
-        login_window.close()
+    hide_windows(change_password_window, events_window, login_window)
     show_contacts_window()
 
 def switch_to_events(): # переключиться на окно событий
-    global change_password_window, events_window
-    if change_password_window:
-        change_password_window.close()
-    if contacts_window:
-        contacts_window.close()
+    hide_windows(change_password_window, contacts_window)
     show_events_window()
 
 if __name__ == '__main__':
@@ -1182,8 +2114,19 @@ if __name__ == '__main__':
         dbPort, dbIP = info['dbPort'], info['dbIP']
 
     serverAddr = (str(dbIP), int(dbPort))
-    clientSock.connect(serverAddr)
+    cache = LocalCache()
+    mutations.journal = Journal()
+    client.start(serverAddr, lambda: dispatcher.replied.emit(on_reconnected, None)) # без сервера - офлайн; журнал уйдет после входа
 
     app = QApplication(sys.argv)
+    debug_hotkey = DebugHotkey()
+    app.installEventFilter(debug_hotkey)
+    watchdog = start_watchdog()
+    atexit.register(dump_telemetry)
+    if hasattr(signal, 'SIGUSR1'): # kill -USR1 <pid> - снимок телеметрии без выхода из приложения
+        signal.signal(signal.SIGUSR1, lambda *args: threading.Thread(target=dump_telemetry).start())
+        signal_timer = QTimer() # обработчики сигналов python выполняются только между вызовами python-кода
+        signal_timer.timeout.connect(lambda: None)
+        signal_timer.start(500)
     show_login_window()
     sys.exit(app.exec_())
@@ -0,0 +1,137 @@
+import os
+import hmac
+import hashlib
+import sqlite3
+
+from protocol import CONTACT_FIELDS, Contact
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS contacts (
+        login TEXT NOT NULL,
+        {', '.join(f'{field} TEXT NOT NULL' for field in CONTACT_FIELDS)},
+        PRIMARY KEY (login, phone)
+    );
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        login TEXT NOT NULL,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS events_by_login ON events (login, date);
+    CREATE TABLE IF NOT EXISTS versions (
+        login TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (login, kind)
+    );
+    CREATE TABLE IF NOT EXISTS accounts (
+        login TEXT PRIMARY KEY,
+        salt BLOB NOT NULL,
+        hash BLOB NOT NULL
+    );
+"""
+PASSWORD_ITERATIONS = 100000 # pbkdf2: подбор пароля по украденному кэшу обходится дорого
+
+UPSERT_CONTACT = f"""
+    INSERT INTO contacts (login, {', '.join(CONTACT_FIELDS)}) VALUES (?, {', '.join('?' * len(CONTACT_FIELDS))})
+    ON CONFLICT (login, phone) DO UPDATE SET {', '.join(f'{field} = excluded.{field}' for field in CONTACT_FIELDS[:-1])}
+"""
+
+def default_cache_path(): # ~/.local/share/PeopleAndPlaces/cache.sqlite3 (или $XDG_DATA_HOME)
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'PeopleAndPlaces', 'cache.sqlite3')
+
+def password_hash(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_ITERATIONS)
+
+class LocalCache: # локальная копия контактов и событий пользователя с номером версии сервера
+    def __init__(self, path=None):
+        path = path or default_cache_path()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def version(self, login, kind): # kind - 'contacts' или 'events'
+        row = self.db.execute('SELECT version FROM versions WHERE login = ? AND kind = ?', (login, kind)).fetchone()
+        return row[0] if row else 0
+
+    def set_version(self, login, kind, version):
+        self.db.execute('INSERT OR REPLACE INTO versions (login, kind, version) VALUES (?, ?, ?)', (login, kind, version))
+
+    def remember_password(self, login, password): # после входа, подтвержденного сервером: для входа без связи
+        salt = os.urandom(16)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO accounts (login, salt, hash) VALUES (?, ?, ?)',
+                            (login, salt, password_hash(password, salt)))
+
+    def check_password(self, login, password): # вход без связи: пароль сверяется с последним подтвержденным сервером
+        row = self.db.execute('SELECT salt, hash FROM accounts WHERE login = ?', (login,)).fetchone()
+        return row is not None and hmac.compare_digest(password_hash(password, row[0]), row[1])
+
+    def forget_password(self, login):
+        with self.db:
+            self.db.execute('DELETE FROM accounts WHERE login = ?', (login,))
+
+    def forget_versions(self, login): # следующая синхронизация загрузит все заново
+        with self.db:
+            self.db.execute('UPDATE versions SET version = 0 WHERE login = ?', (login,))
+
+    def load_contacts(self, login):
+        return [Contact(*row) for row in self.iter_contact_rows(login)]
+
+    def load_events(self, login): # -> [(дата, название)]
+        return self.iter_event_rows(login).fetchall()
+
+    def iter_contact_rows(self, login): # курсор: строки читаются по мере обхода, без списка в памяти
+        return self.db.execute(f'SELECT {", ".join(CONTACT_FIELDS)} FROM contacts WHERE login = ? ORDER BY rowid', (login,))
+
+    def iter_event_rows(self, login):
+        return self.db.execute('SELECT date, name FROM events WHERE login = ? ORDER BY id', (login,))
+
+    def load_events_range(self, login, first, last): # события с first по last включительно, даты 'yyyy-MM-dd'
+        return self.db.execute('SELECT date, name FROM events WHERE login = ? AND date BETWEEN ? AND ? ORDER BY date, id',
+                               (login, first, last)).fetchall()
+
+    def replace_contacts(self, login, contacts, version=0): # полный снимок вместо старого
+        with self.db:
+            self.db.execute('DELETE FROM contacts WHERE login = ?', (login,))
+            self.db.executemany(UPSERT_CONTACT, ([login] + contact.fields() for contact in contacts))
+            self.set_version(login, 'contacts', version)
+
+    def apply_contacts_delta(self, login, version, reset, changes):
+        with self.db:
+            if reset:
+                self.db.execute('DELETE FROM contacts WHERE login = ?', (login,))
+            for operation, value in changes:
+                if operation == '+':
+                    self.db.execute(UPSERT_CONTACT, [login] + value.fields())
+                else:
+                    self.db.execute('DELETE FROM contacts WHERE login = ? AND phone = ?', (login, value))
+            self.set_version(login, 'contacts', version)
+
+    def replace_events(self, login, events, version=0):
+        with self.db:
+            self.db.execute('DELETE FROM events WHERE login = ?', (login,))
+            self.db.executemany('INSERT INTO events (login, date, name) VALUES (?, ?, ?)', ((login, date, name) for date, name in events))
+            self.set_version(login, 'events', version)
+
+    def replace_events_range(self, login, first, last, events): # свежий ответ get_events за диапазон дат
+        with self.db:
+            self.db.execute('DELETE FROM events WHERE login = ? AND date BETWEEN ? AND ?', (login, first, last))
+            self.db.executemany('INSERT INTO events (login, date, name) VALUES (?, ?, ?)', ((login, date, name) for date, name in events))
+
+    def apply_events_delta(self, login, version, reset, changes):
+        with self.db:
+            if reset:
+                self.db.execute('DELETE FROM events WHERE login = ?', (login,))
+            for operation, date, name in changes:
+                if operation == '+':
+                    self.db.execute('INSERT INTO events (login, date, name) VALUES (?, ?, ?)', (login, date, name))
+                else:
+                    self.db.execute('DELETE FROM events WHERE id = (SELECT id FROM events WHERE login = ? AND date = ? AND name = ? LIMIT 1)',
+                                    (login, date, name))
+            self.set_version(login, 'events', version)
+
+    def close(self):
+        self.db.close()
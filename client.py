@@ -0,0 +1,184 @@
+from network import ServerConnection
+from protocol import (
+    ReplyError,
+    parse_batch,
+    parse_contacts_delta,
+    parse_events_delta,
+    read_contact_list,
+    read_event_list,
+    add_contact_command,
+    add_contacts_command,
+    change_contact_command,
+    remove_contact_command,
+    remove_contacts_command,
+    add_event_command,
+    change_event_command,
+    remove_event_command,
+    remove_events_command
+)
+from telemetry import telemetry
+
+# Клиент протокола без интерфейса: команды, разбор ответов и согласованные возможности сервера.
+# Каждый метод либо блокирует и возвращает разобранный ответ, либо, если передан callback,
+# сразу возвращает Future, а callback получит тот же результат. None - нет связи с сервером;
+# если вместо списка или изменений сервер ответил ошибкой, возвращается ее текст (str).
+#     client = Client()
+#     client.connect(('127.0.0.1', 5289))
+#     if client.login('user', 'password') == SUCCESSFUL_LOGIN:
+#         contacts = client.get_contacts('user')
+
+# ответы сервера
+SUCCESSFUL_LOGIN = 'successful login'
+WRONG_LOGIN = 'wrong login'
+WRONG_PASSWORD = 'wrong password'
+LOGIN_EXISTS = 'login already exists'
+SUCCESSFUL_CHANGE_PASSWORD = 'successful change_password'
+SUCCESSFUL_ADD_CONTACT = 'successful add_contact'
+SUCCESSFUL_CHANGE_CONTACT = 'successful change_contact'
+SUCCESSFUL_REMOVE_CONTACT = 'successful remove_contact'
+DUPLICATE_CONTACT = 'contact with this phone number is already exists'
+SUCCESSFUL_ADD_EVENT = 'successful add_event'
+SUCCESSFUL_CHANGE_EVENT = 'successful change_event'
+SUCCESSFUL_REMOVE_EVENT = 'successful remove_event'
+BATCH_OK = 'ok' # результат элемента пакетной команды
+
+def refused(result): # сервер ответил текстом ошибки вместо списка или изменений
+    return isinstance(result, str)
+
+def delta_size(delta): # число изменений в разобранном ответе *_since
+    return len(delta[2])
+
+# Команды для очереди отложенной записи и журнала: интерфейс описывает изменение (op - 'add', 'change' или 'remove',
+# old и new - запись до и после), а строку протокола строит клиент
+def contact_command(login, op, old, new): # old, new - Contact
+    if op == 'add':
+        return add_contact_command(login, new)
+    if op == 'change':
+        return change_contact_command(login, old.phone, new)
+    return remove_contact_command(login, old.phone)
+
+def contacts_batch_command(login, op, contacts): # пакет добавлений (новые записи) или удалений (старые записи)
+    if op == 'add':
+        return add_contacts_command(login, contacts)
+    return remove_contacts_command(login, [contact.phone for contact in contacts])
+
+def event_command(login, op, old, new): # old, new - (дата 'yyyy-MM-dd', название)
+    if op == 'add':
+        return add_event_command(login, *new)
+    if op == 'change':
+        return change_event_command(login, *old, new[1])
+    return remove_event_command(login, *old)
+
+def events_batch_command(login, date, names): # пакетом удаляются только события одной даты
+    return remove_events_command(login, date, names)
+
+class Client:
+    def __init__(self, connection=None, deliver=None):
+        self.connection = connection or ServerConnection()
+        self.deliver = deliver # deliver(callback, результат) - перенос в нужный поток; без него callback вызывается в сетевом потоке
+
+    # соединение
+    def connect(self, address): # подключение с ошибкой OSError, если сервер недоступен
+        self.connection.connect(address)
+
+    def start(self, address, on_online=None): # подключение без ошибки: без сервера - офлайн и повторные попытки в фоне
+        return self.connection.start(address, on_online)
+
+    def close(self):
+        self.connection.close()
+
+    def supports(self, feature): # согласована ли возможность протокола ('batch', 'delta', 'paging', ...)
+        return feature in self.connection.features
+
+    @property
+    def online(self):
+        return self.connection.online
+
+    def request(self, message, callback=None, raw=False, parse=None): # произвольная команда; parse(ответ) выполняется
+        future = self.connection.submit(message, raw)                  # в сетевом потоке, а не в потоке интерфейса
+        if callback is None:
+            return self.parse_answer(future.result(), parse)
+
+        def done(future):
+            result = self.parse_answer(future.result(), parse)
+            if self.deliver:
+                self.deliver(callback, result)
+            else:
+                callback(result)
+        future.add_done_callback(done)
+        return future
+
+    def parse_answer(self, answer, parse):
+        if answer is None or parse is None:
+            return answer
+        try:
+            return parse(answer)
+        except ReplyError as error: # отказ сервера отличается от отсутствия связи
+            return error.reply
+        except Exception as e: # ответ не разобрался - для вызывающего это то же, что отказ
+            print(f"Error parsing server answer: {e}")
+            return None
+
+    def list_request(self, message, callback, name, read): # список в текстовом или двоичном виде, как согласовано
+        binary = self.supports('binary')
+        return self.request(message, callback, binary, lambda answer: telemetry.timed_parse(name, lambda answer: read(answer, binary), answer))
+
+    # учетная запись: ответ сервера как есть (SUCCESSFUL_LOGIN, WRONG_LOGIN, WRONG_PASSWORD, LOGIN_EXISTS, ...)
+    def login(self, login, password, callback=None):
+        return self.request(f'login {login} {password}', callback)
+
+    def register(self, login, password, confirm_password, callback=None):
+        return self.request(f'register {login} {password} {confirm_password}', callback)
+
+    def change_password(self, login, password, callback=None):
+        return self.request(f'change_password {login} {password}', callback)
+
+    # контакты: списки -> [Contact], изменения -> (версия, сброс, [('+', Contact) или ('-', телефон)])
+    def get_contacts(self, login, callback=None):
+        return self.list_request(f'get_contacts {login}', callback, 'contacts', read_contact_list)
+
+    def get_contacts_page(self, login, offset, count, callback=None):
+        return self.list_request(f'get_contacts_page {login} {offset} {count}', callback, 'contacts', read_contact_list)
+
+    def get_contacts_since(self, login, version, callback=None):
+        return self.request(f'get_contacts_since {login} {version}', callback,
+                            parse=lambda answer: telemetry.timed_parse('contacts_delta', parse_contacts_delta, answer, delta_size))
+
+    def add_contact(self, login, contact, callback=None): # -> SUCCESSFUL_ADD_CONTACT или DUPLICATE_CONTACT
+        return self.request(add_contact_command(login, contact), callback)
+
+    def add_contacts(self, login, contacts, callback=None): # -> результат по каждому контакту (BATCH_OK или ошибка)
+        count = len(contacts)
+        return self.request(add_contacts_command(login, contacts), callback, parse=lambda answer: parse_batch(answer, count))
+
+    def change_contact(self, login, old_phone, contact, callback=None):
+        return self.request(change_contact_command(login, old_phone, contact), callback)
+
+    def remove_contact(self, login, phone, callback=None):
+        return self.request(remove_contact_command(login, phone), callback)
+
+    def remove_contacts(self, login, phones, callback=None):
+        count = len(phones)
+        return self.request(remove_contacts_command(login, phones), callback, parse=lambda answer: parse_batch(answer, count))
+
+    # события: списки -> [(дата 'yyyy-MM-dd', название)], first/last - диапазон дат при поддержке 'range'
+    def get_events(self, login, first=None, last=None, callback=None):
+        message = f'get_events {login}' if first is None else f'get_events {login} {first} {last}'
+        return self.list_request(message, callback, 'events', read_event_list)
+
+    def get_events_since(self, login, version, callback=None):
+        return self.request(f'get_events_since {login} {version}', callback,
+                            parse=lambda answer: telemetry.timed_parse('events_delta', parse_events_delta, answer, delta_size))
+
+    def add_event(self, login, date, name, callback=None):
+        return self.request(add_event_command(login, date, name), callback)
+
+    def change_event(self, login, date, old_name, new_name, callback=None):
+        return self.request(change_event_command(login, date, old_name, new_name), callback)
+
+    def remove_event(self, login, date, name, callback=None):
+        return self.request(remove_event_command(login, date, name), callback)
+
+    def remove_events(self, login, date, names, callback=None):
+        count = len(names)
+        return self.request(remove_events_command(login, date, names), callback, parse=lambda answer: parse_batch(answer, count))
@@ -0,0 +1,84 @@
+import csv
+import json
+import os
+from datetime import datetime, timezone
+
+EVENT_FIELDS = ('date', 'name')
+LINE_OCTETS = 75 # RFC 5545 3.1: строка iCalendar длиннее стольких байт переносится
+
+class CsvExporter: # строки пишутся в файл сразу по мере поступления
+    def __init__(self, file, fields):
+        self.writer = csv.writer(file)
+        self.writer.writerow(fields)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+class JsonExporter: # массив объектов, который пишется по одному элементу
+    def __init__(self, file, fields):
+        self.file = file
+        self.fields = fields
+        self.first = True
+        file.write('[')
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write('\n' if self.first else ',\n')
+            self.file.write(json.dumps(dict(zip(self.fields, row)), ensure_ascii=False))
+            self.first = False
+
+    def close(self):
+        self.file.write('\n]\n')
+
+class ICalendarExporter: # события как VEVENT на целый день
+    def __init__(self, file, fields):
+        self.file = file
+        self.count = 0
+        self.stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        file.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//PeopleAndPlaces//RU\r\n')
+
+    def write(self, rows):
+        for date, name in rows:
+            self.count += 1
+            day = date.replace('-', '')
+            summary = name.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            self.file.write(f'BEGIN:VEVENT\r\nUID:{day}-{self.count}@peopleandplaces\r\nDTSTAMP:{self.stamp}\r\n'
+                            f'DTSTART;VALUE=DATE:{day}\r\n{fold_line("SUMMARY:" + summary)}END:VEVENT\r\n')
+
+    def close(self):
+        self.file.write('END:VCALENDAR\r\n')
+
+def fold_line(line): # -> строка с CRLF; длинная переносится по границе символа utf-8, продолжение начинается с пробела
+    data = line.encode()
+    parts = []
+    start, limit = 0, LINE_OCTETS
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80: # байт из середины многобайтового символа
+            end -= 1
+        parts.append(data[start:end])
+        start, limit = end, LINE_OCTETS - 1 # пробел продолжения входит в длину строки
+    parts.append(data[start:])
+    return b'\r\n '.join(parts).decode() + '\r\n'
+
+EXPORTERS = {'.csv': CsvExporter, '.json': JsonExporter, '.ics': ICalendarExporter}
+
+class ExportFile: # файл экспорта, формат выбирается по расширению
+    def __init__(self, path, fields):
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in EXPORTERS or (extension == '.ics' and fields != EVENT_FIELDS):
+            raise ValueError(f'unsupported export format: {extension}')
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.exporter = EXPORTERS[extension](self.file, fields)
+        self.rows = 0
+
+    def write(self, rows): # rows - список строк со значениями в порядке полей
+        self.exporter.write(rows)
+        self.rows += len(rows)
+
+    def close(self):
+        self.exporter.close()
+        self.file.close()
@@ -0,0 +1,120 @@
+import csv
+import os
+from itertools import islice
+
+from protocol import CONTACT_FIELDS
+from validation import normalize_contact, validate_contacts
+
+IMPORT_BATCH_SIZE = 500 # столько контактов читается, проверяется и отправляется за раз
+MAX_REPORTED_ERRORS = 20 # сколько ошибочных строк запоминать для отчета
+
+def iter_csv(file): # строки CSV как словари; заголовок с именами полей необязателен
+    sample = file.read(4096)
+    file.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(file, dialect)
+
+    first = next(reader, None)
+    if first is None:
+        return
+    header = [name.strip().lower() for name in first]
+    if 'phone' in header:
+        for row in reader:
+            yield dict(zip(header, row))
+    else: # заголовка нет, столбцы идут в порядке полей протокола
+        yield dict(zip(CONTACT_FIELDS, first))
+        for row in reader:
+            yield dict(zip(CONTACT_FIELDS, row))
+
+def unfold_lines(lines): # склейка перенесенных строк vCard (продолжение начинается с пробела)
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+def split_house(street): # 'Ленина 5а' -> ('Ленина', '5а')
+    name, _, house = street.rpartition(' ')
+    if name and any(char.isdigit() for char in house):
+        return '-'.join(name.split()), house
+    return '-'.join(street.split()), ''
+
+def iter_vcard(file): # карточки vCard как словари: N, BDAY, первый TEL и первый ADR
+    card = None
+    for line in unfold_lines(file):
+        name, _, value = line.partition(':')
+        key = name.split(';')[0].upper()
+        if key == 'BEGIN':
+            card = {}
+        elif key == 'END':
+            if card is not None:
+                yield card
+            card = None
+        elif card is None:
+            continue
+        elif key == 'N':
+            parts = value.split(';') + [''] * 3
+            card['surname'], card['name'], card['patronymic'] = parts[0], parts[1], parts[2]
+        elif key == 'BDAY':
+            card['birth_date'] = value.replace('-', '')[:8]
+        elif key == 'TEL' and 'phone' not in card:
+            card['phone'] = value
+        elif key == 'ADR' and 'city' not in card: # почтовый ящик;квартира;улица с домом;город;...
+            parts = value.split(';') + [''] * 4
+            card['apartment_number'] = ''.join(char for char in parts[1] if char.isdigit())
+            card['street'], card['house_number'] = split_house(parts[2].strip())
+            card['city'] = '-'.join(parts[3].split())
+
+class ContactImporter: # потоковый импорт: в памяти только текущая пачка и множество уже встреченных телефонов
+    def __init__(self, path, known_phones=()):
+        self.file = open(path, encoding='utf-8-sig', newline='')
+        self.size = os.fstat(self.file.fileno()).st_size
+        is_vcard = path.lower().endswith(('.vcf', '.vcard'))
+        self.records = iter_vcard(self.file) if is_vcard else iter_csv(self.file)
+        self.seen_phones = set(known_phones)
+        self.rows = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = [] # (номер строки, {поле: (заголовок, текст)}) для первых ошибочных строк
+        self.done = False
+
+    def next_batch(self, size=IMPORT_BATCH_SIZE): # -> проверенные контакты без повторов; после конца файла done = True
+        batch = [normalize_contact(record) for record in islice(self.records, size)]
+        if len(batch) < size:
+            self.done = True
+
+        invalid_rows = set()
+        for index, errors in validate_contacts(batch): # вся пачка проверяется за один проход
+            invalid_rows.add(index)
+            self.invalid += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append((self.rows + index + 1, errors))
+
+        contacts = []
+        for index, contact in enumerate(batch):
+            if index in invalid_rows:
+                continue
+            if contact['phone'] in self.seen_phones:
+                self.duplicates += 1
+                continue
+            self.seen_phones.add(contact['phone'])
+            contacts.append(contact)
+        self.rows += len(batch)
+        return contacts
+
+    def progress(self): # доля прочитанного файла, от 0 до 1
+        if self.done or not self.size:
+            return 1
+        return min(self.file.buffer.tell() / self.size, 1)
+
+    def close(self):
+        self.file.close()
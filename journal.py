@@ -0,0 +1,98 @@
+import json
+import os
+from collections import deque
+
+from cache import default_cache_path
+
+def default_journal_path(): # рядом с локальным кэшем
+    return os.path.join(os.path.dirname(default_cache_path()), 'journal.jsonl')
+
+class Journal: # изменения, сделанные без связи: строки только дописываются, каждая сразу сбрасывается на диск
+    def __init__(self, path=None):
+        self.path = path or default_journal_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.entries = deque() # (номер, команда) еще не подтвержденные сервером, в порядке записи
+        self.last_seq = 0
+        self.load()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def load(self): # записи без отметки о выполнении; файл переписывается без выполненных и недописанных строк
+        if not os.path.exists(self.path):
+            return
+        done = set()
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError: # строка, недописанная при сбое
+                    continue
+                if 'ack' in record:
+                    done.add(record['ack'])
+                else:
+                    self.entries.append((record['seq'], record['command']))
+                    self.last_seq = max(self.last_seq, record['seq'])
+        self.entries = deque(entry for entry in self.entries if entry[0] not in done)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.writelines(record_line({'seq': seq, 'command': command}) for seq, command in self.entries)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def extend(self, commands): # пачка записей - одна синхронизация с диском
+        lines = []
+        for command in commands:
+            self.last_seq += 1
+            self.entries.append((self.last_seq, command))
+            lines.append(record_line({'seq': self.last_seq, 'command': command}))
+        self.write(lines)
+
+    def holds(self, login): # есть ли неотправленные изменения пользователя
+        return any(command_login(command) == login for seq, command in self.entries)
+
+    def next_entry(self, login): # -> (номер, команда) самого старого изменения пользователя или None
+        for seq, command in self.entries:
+            if command_login(command) == login:
+                return seq, command
+        return None
+
+    def ack(self, seq): # запись выполнена (принята сервером или ушла в конфликты)
+        if self.entries and self.entries[0][0] == seq: # подтверждения обычно приходят по порядку
+            self.entries.popleft()
+        else:
+            self.entries = deque(entry for entry in self.entries if entry[0] != seq)
+        self.write_acks([seq])
+
+    def discard(self, login): # -> команды пользователя, которые уже не будут отправлены (вход не подтвердился)
+        dropped = [(seq, command) for seq, command in self.entries if command_login(command) == login]
+        if dropped:
+            self.entries = deque(entry for entry in self.entries if command_login(entry[1]) != login)
+            self.write_acks([seq for seq, command in dropped])
+        return [command for seq, command in dropped]
+
+    def write_acks(self, seqs):
+        if self.entries:
+            self.write([record_line({'ack': seq}) for seq in seqs])
+        else: # журнал пуст - файл больше не нужен
+            self.file.truncate(0)
+            self.sync()
+
+    def write(self, lines):
+        self.file.writelines(lines)
+        self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def command_login(command): # 'add_contact login ...' -> 'login'
+    return command.split(' ', 2)[1]
+
+def record_line(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
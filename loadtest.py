@@ -0,0 +1,247 @@
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+from protocol import Contact
+from client import (
+    Client,
+    refused,
+    SUCCESSFUL_LOGIN,
+    SUCCESSFUL_ADD_CONTACT,
+    SUCCESSFUL_CHANGE_CONTACT,
+    SUCCESSFUL_REMOVE_CONTACT,
+    SUCCESSFUL_ADD_EVENT,
+    SUCCESSFUL_CHANGE_EVENT,
+    SUCCESSFUL_REMOVE_EVENT,
+    BATCH_OK
+)
+
+# Нагрузочный прогон без интерфейса: N сессий одновременно выполняют смесь команд через тот же
+# клиент протокола, что и интерфейс (client.py). Время команды - от отправки
+# до разобранного ответа, как его видит клиент. Пример:
+#     python loadtest.py --port 5289 --sessions 200 --duration 30 --json run.json
+
+DEFAULT_MIX = 'login=1,get_contacts=2,add_contact=4,change_contact=2,remove_contact=1,get_events=2,add_event=4,change_event=2,remove_event=1'
+PERCENTILES = (50, 95, 99)
+
+def parse_mix(text): # 'команда=вес,...' -> [(команда, вес)]
+    mix = []
+    for part in text.split(','):
+        command, _, weight = part.partition('=')
+        if command not in COMMANDS:
+            raise ValueError(f'unknown command in mix: {command}')
+        mix.append((command, float(weight or 1)))
+    return mix
+
+def percentile(values, p): # values отсортированы; ближайший ранг
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class Stats: # задержки и ошибки по командам, общие для всех сессий
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, command, latency, ok):
+        with self.lock:
+            self.latencies.setdefault(command, []).append(latency)
+            if not ok:
+                self.errors[command] = self.errors.get(command, 0) + 1
+
+    def report(self, duration): # -> словарь для JSON: по командам и итог
+        commands = {}
+        total = 0
+        for command, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            total += len(latencies)
+            commands[command] = {
+                'count': len(latencies),
+                'errors': self.errors.get(command, 0),
+                'throughput': round(len(latencies) / duration, 2),
+                **{f'p{p}_ms': round(percentile(latencies, p) * 1000, 3) for p in PERCENTILES},
+                'max_ms': round(latencies[-1] * 1000, 3),
+            }
+        return {'duration': round(duration, 3), 'requests': total, 'throughput': round(total / duration, 2),
+                'errors': sum(self.errors.values()), 'commands': commands}
+
+class Session: # один пользователь со своими контактами и событиями
+    def __init__(self, number, args, stats):
+        self.args = args
+        self.stats = stats
+        self.random = random.Random(args.seed * 100003 + number)
+        self.login = f'{args.prefix}{number}'
+        self.password = 'load_pass1'
+        self.client = Client()
+        self.phones = [] # номера контактов, созданных этой сессией
+        self.events = [] # (дата, название)
+        self.counter = 0
+
+    def request(self, command, call, check): # одна команда с замером; call() -> разобранный ответ, check(ответ) -> успех
+        start = time.perf_counter()
+        answer = call()
+        ok = answer is not None and check(answer) # неразборчивый ответ клиент возвращает как None - тоже ошибка
+        self.stats.record(command, time.perf_counter() - start, ok)
+        return ok
+
+    def setup(self): # подключение, учетная запись и начальные данные; в статистику не входит
+        self.client.connect((self.args.host, self.args.port))
+        self.client.register(self.login, self.password, self.password)
+        contacts = [self.new_contact() for _ in range(self.args.contacts)]
+        if not contacts:
+            return
+        if self.client.supports('batch'):
+            results = self.client.add_contacts(self.login, contacts) or []
+            self.phones = [contact.phone for contact, result in zip(contacts, results) if result == BATCH_OK]
+        else:
+            for contact in contacts:
+                if self.client.add_contact(self.login, contact) == SUCCESSFUL_ADD_CONTACT:
+                    self.phones.append(contact.phone)
+
+    def new_contact(self):
+        self.counter += 1
+        return Contact('Нагрузкин', self.random.choice(('Иван', 'Петр', 'Анна')), 'Тестович', '2000-01-01', 'Москва', 'Ленина',
+                       '1', str(self.counter), f'+7{self.random.randrange(10 ** 10):010d}')
+
+    def new_event(self):
+        self.counter += 1
+        return f'2026-{self.random.randint(1, 12):02d}-{self.random.randint(1, 28):02d}', f'Событие {self.counter}'
+
+    def run(self, mix, deadline):
+        commands = [command for command, weight in mix]
+        weights = [weight for command, weight in mix]
+        done = 0
+        while time.monotonic() < deadline and (not self.args.requests or done < self.args.requests):
+            COMMANDS[self.random.choices(commands, weights)[0]](self)
+            done += 1
+            if self.args.think:
+                time.sleep(self.random.expovariate(1000 / self.args.think))
+
+    # команды смеси; изменение и удаление без своих данных заменяются добавлением
+    def do_login(self):
+        self.request('login', lambda: self.client.login(self.login, self.password), lambda answer: answer == SUCCESSFUL_LOGIN)
+
+    def do_get_contacts(self):
+        self.request('get_contacts', lambda: self.client.get_contacts(self.login), lambda contacts: not refused(contacts))
+
+    def do_add_contact(self):
+        contact = self.new_contact()
+        if self.request('add_contact', lambda: self.client.add_contact(self.login, contact), lambda answer: answer == SUCCESSFUL_ADD_CONTACT):
+            self.phones.append(contact.phone)
+
+    def do_change_contact(self):
+        if not self.phones:
+            return self.do_add_contact()
+        position = self.random.randrange(len(self.phones))
+        contact = self.new_contact()
+        if self.request('change_contact', lambda: self.client.change_contact(self.login, self.phones[position], contact),
+                        lambda answer: answer == SUCCESSFUL_CHANGE_CONTACT):
+            self.phones[position] = contact.phone
+
+    def do_remove_contact(self):
+        if not self.phones:
+            return self.do_add_contact()
+        phone = self.phones.pop(self.random.randrange(len(self.phones)))
+        self.request('remove_contact', lambda: self.client.remove_contact(self.login, phone), lambda answer: answer == SUCCESSFUL_REMOVE_CONTACT)
+
+    def do_get_events(self):
+        self.request('get_events', lambda: self.client.get_events(self.login), lambda events: not refused(events))
+
+    def do_add_event(self):
+        date, name = self.new_event()
+        if self.request('add_event', lambda: self.client.add_event(self.login, date, name), lambda answer: answer == SUCCESSFUL_ADD_EVENT):
+            self.events.append((date, name))
+
+    def do_change_event(self):
+        if not self.events:
+            return self.do_add_event()
+        position = self.random.randrange(len(self.events))
+        date, old_name = self.events[position]
+        new_name = self.new_event()[1]
+        if self.request('change_event', lambda: self.client.change_event(self.login, date, old_name, new_name),
+                        lambda answer: answer == SUCCESSFUL_CHANGE_EVENT):
+            self.events[position] = (date, new_name)
+
+    def do_remove_event(self):
+        if not self.events:
+            return self.do_add_event()
+        date, name = self.events.pop(self.random.randrange(len(self.events)))
+        self.request('remove_event', lambda: self.client.remove_event(self.login, date, name), lambda answer: answer == SUCCESSFUL_REMOVE_EVENT)
+
+COMMANDS = {
+    'login': Session.do_login,
+    'get_contacts': Session.do_get_contacts,
+    'add_contact': Session.do_add_contact,
+    'change_contact': Session.do_change_contact,
+    'remove_contact': Session.do_remove_contact,
+    'get_events': Session.do_get_events,
+    'add_event': Session.do_add_event,
+    'change_event': Session.do_change_event,
+    'remove_event': Session.do_remove_event,
+}
+
+def run_load(args): # -> отчет
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    sessions = [Session(number, args, stats) for number in range(args.sessions)]
+    threading.stack_size(512 * 1024) # сотни сессий - сотни потоков
+    setups = [threading.Thread(target=session.setup, daemon=True) for session in sessions]
+    for thread in setups:
+        thread.start()
+    for thread in setups:
+        thread.join()
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    workers = [threading.Thread(target=session.run, args=(mix, deadline), daemon=True) for session in sessions]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    report = stats.report(time.monotonic() - start)
+    for session in sessions:
+        session.client.close()
+    report['config'] = {'host': args.host, 'port': args.port, 'sessions': args.sessions, 'mix': args.mix,
+                        'contacts': args.contacts, 'think_ms': args.think, 'seed': args.seed,
+                        'features': sorted(sessions[0].client.connection.features) if sessions else []}
+    return report
+
+def print_report(report, file=sys.stdout):
+    print(f"{report['requests']} requests in {report['duration']} s, {report['throughput']} req/s, {report['errors']} errors", file=file)
+    print(f"{'command':<16}{'count':>8}{'errors':>8}{'req/s':>10}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}", file=file)
+    for command, row in report['commands'].items():
+        print(f"{command:<16}{row['count']:>8}{row['errors']:>8}{row['throughput']:>10}"
+              + ''.join(f"{row[f'p{p}_ms']:>10}" for p in PERCENTILES) + f"{row['max_ms']:>10}", file=file)
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон протокола PeopleAndPlaces')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5289)
+    parser.add_argument('--sessions', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--duration', type=float, default=10, help='секунд прогона')
+    parser.add_argument('--requests', type=int, default=0, help='команд на сессию, 0 - без ограничения')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="веса команд: 'login=1,add_event=4,...'")
+    parser.add_argument('--contacts', type=int, default=100, help='контактов у каждого пользователя до начала замеров')
+    parser.add_argument('--think', type=float, default=0, help='средняя пауза между командами сессии, мс')
+    parser.add_argument('--prefix', default='load_', help='начало логинов пользователей прогона')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="файл для отчета в JSON, '-' - вывод в консоль")
+    args = parser.parse_args()
+
+    report = run_load(args)
+    if args.json == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+from protocol import parse_batch
+
+BATCH_LIMIT = 500 # столько однотипных изменений уходит одним пакетным запросом
+
+class Mutation: # одно изменение записи: op - 'add', 'change' или 'remove', old и new - запись до и после
+    __slots__ = ('owner', 'op', 'old', 'new', 'successor')
+
+    def __init__(self, owner, op, old, new):
+        self.owner = owner # окно, которое строит запросы и откатывает изменение в интерфейсе
+        self.op = op
+        self.old = old
+        self.new = new
+        self.successor = None # следующее изменение, построенное на new этого; откатывается вместе с ним
+
+def accepted(answer): # ответ на одиночную команду или элемент ответа пакетной
+    return answer == 'ok' or (answer or '').startswith('successful')
+
+class MutationQueue: # отложенная запись: интерфейс уже изменен, сервер получает изменения по порядку в фоне
+    def __init__(self, send, journal=None):
+        self.send = send # send(сообщение, callback) - асинхронный запрос
+        self.journal = journal # без связи изменения не откатываются, а ждут в журнале
+        self.pending = [] # еще не отправленные изменения
+        self.in_flight = [] # отправленные одним запросом, ждут ответа
+        self.replaying = False
+        self.replay_login = None
+        self.replayed = []
+        self.conflicts = []
+        self.report = None
+        self.idle_callbacks = []
+
+    def enqueue(self, owner, op, old=None, new=None):
+        mutation = Mutation(owner, op, old, new)
+        previous, waiting = self.predecessor(mutation)
+        if waiting:
+            self.coalesce(previous, mutation)
+        else:
+            if previous is not None:
+                previous.successor = mutation
+            self.pending.append(mutation)
+        self.flush()
+
+    def predecessor(self, mutation): # -> (неподтвержденное изменение, на котором строится mutation, ждет ли оно отправки)
+        if mutation.op == 'add':
+            return None, False
+        key = mutation.owner.mutation_key(mutation.old)
+        for queue, waiting in ((self.pending, True), (self.in_flight, False)): # от последнего к первому
+            for previous in reversed(queue): # на занятом значении уже построено другое изменение, так одинаковые события не путаются
+                if (previous.owner is mutation.owner and previous.new is not None and previous.successor is None
+                        and previous.owner.mutation_key(previous.new) == key):
+                    return previous, waiting
+        return None, False
+
+    def coalesce(self, previous, mutation): # слить с еще не отправленным изменением той же записи
+        if mutation.op == 'change': # добавление или изменение уйдет сразу с последним значением
+            previous.new = mutation.new
+        elif previous.op == 'add': # запись удалена раньше, чем дошла до сервера
+            self.pending.remove(previous)
+        else: # изменение, затем удаление - удаляется исходная запись
+            previous.op, previous.new = 'remove', None
+
+    def when_idle(self, callback): # callback() - когда все изменения подтверждены сервером или записаны в журнал
+        if self.in_flight or self.pending or self.replaying:
+            self.idle_callbacks.append(callback)
+        else:
+            callback()
+
+    def notify_idle(self):
+        if self.in_flight or self.pending or self.replaying or not self.idle_callbacks:
+            return
+        callbacks, self.idle_callbacks = self.idle_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def unconfirmed(self, owner): # изменения владельца, которых сервер еще не подтвердил, в порядке отправки
+        return [mutation for mutation in self.in_flight + self.pending if mutation.owner is owner]
+
+    def flush(self): # следующий запрос уходит, когда сервер ответил на предыдущий
+        if self.in_flight or self.replaying or not self.pending:
+            return
+        first = self.pending[0]
+        if self.journal is not None and self.journal.holds(first.owner.login): # журнал пользователя еще не воспроизведен,
+            self.write_journal(self.pending)                                     # новые изменения встают за ним
+            self.pending = []
+            self.notify_idle()
+            return
+        group = [first]
+        for mutation in self.pending[1:BATCH_LIMIT]: # подряд идущие однотипные изменения - одним пакетом
+            if mutation.owner is not first.owner or mutation.op != first.op or not first.owner.mutation_batchable(first, mutation):
+                break
+            group.append(mutation)
+        del self.pending[:len(group)]
+        self.in_flight = group
+        if len(group) == 1:
+            self.send(first.owner.mutation_command(first), self.on_answer)
+        else:
+            self.send(first.owner.mutation_batch_command(group), self.on_answer)
+
+    def on_answer(self, answer):
+        group, self.in_flight = self.in_flight, []
+        if answer is None and self.journal is not None: # нет связи: изменения остаются в интерфейсе
+            self.write_journal(group)
+            self.flush()
+            self.notify_idle()
+            return
+        if len(group) == 1:
+            results = [answer]
+        else:
+            results = parse_batch(answer, len(group)) or [answer] * len(group)
+
+        rejected = {} # владелец -> [(изменение, ответ)], по одному сообщению на ответ сервера
+        for mutation, result in zip(group, results):
+            if not accepted(result):
+                self.roll_back(mutation)
+                rejected.setdefault(mutation.owner, []).append((mutation, result))
+        for owner, mutations in rejected.items():
+            owner.mutation_rejected(mutations)
+        self.flush()
+        self.notify_idle()
+
+    def roll_back(self, mutation): # ожидающие изменения, построенные на отклоненном, откатываются первыми
+        chain = []
+        dependent = mutation.successor
+        while dependent is not None and dependent in self.pending: # отправленное вместе с отклоненным получит свой ответ
+            chain.append(dependent)
+            dependent = dependent.successor
+        for dependent in reversed(chain):
+            self.pending.remove(dependent)
+            dependent.owner.mutation_rollback(dependent)
+        mutation.owner.mutation_rollback(mutation)
+
+    def write_journal(self, mutations):
+        self.journal.extend([mutation.owner.mutation_command(mutation) for mutation in mutations])
+        for mutation in mutations:
+            mutation.owner.mutation_journaled(mutation)
+
+    def replay(self, report, login): # вход login подтвержден сервером: его журнал уходит по порядку -> False, если журнал пуст
+        if self.replaying or not self.journal or not self.journal.holds(login): # report(выполненные команды, [(команда, ответ)] конфликтов)
+            return False
+        self.replaying = True
+        self.replay_login = login
+        self.report = report
+        self.replay_next()
+        return True
+
+    def replay_next(self):
+        entry = self.journal.next_entry(self.replay_login)
+        if entry is None:
+            self.finish_replay()
+            return
+        seq, command = entry
+        self.send(command, lambda answer: self.on_replayed(seq, command, answer))
+
+    def on_replayed(self, seq, command, answer):
+        if answer is None: # связь снова потеряна, остаток дождется следующего подключения
+            self.finish_replay()
+            return
+        if not accepted(answer): # изменение расходится с данными на сервере
+            self.conflicts.append((command, answer))
+        self.replayed.append(command)
+        self.journal.ack(seq)
+        self.replay_next()
+
+    def finish_replay(self):
+        replayed, conflicts = self.replayed, self.conflicts
+        self.replaying, self.replay_login, self.replayed, self.conflicts = False, None, [], []
+        if self.report:
+            self.report(replayed, conflicts)
+        self.flush()
+        self.notify_idle()
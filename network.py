@@ -0,0 +1,290 @@
+import socket
+import struct
+import threading
+import time
+import queue
+import zlib
+from concurrent.futures import Future
+
+from telemetry import telemetry, command_verb
+
+HEADER = struct.Struct('!I') # заголовок кадра: длина данных, 4 байта big-endian
+TAGGED_HEADER = struct.Struct('!II') # заголовок кадра с номером запроса: длина данных и id
+COMPRESSED = 0x80000000 # старший бит длины: данные кадра сжаты zlib
+CHUNK_SIZE = 65536
+COMPRESS_THRESHOLD = 1024 # кадры меньше этого размера не сжимаются
+HANDSHAKE_TIMEOUT = 3 # старый сервер на hello может не ответить вовсе
+RECONNECT_INTERVAL = 5 # секунд между попытками восстановить соединение
+CLIENT_FEATURES = ['framed', 'paging', 'delta', 'batch', 'tagged', 'binary', 'zlib', 'range'] # возможности протокола, которые поддерживает клиент
+FRAMED_FEATURES = {'tagged', 'binary', 'zlib'} # работают только поверх кадров
+
+def encode_frame(message, request_id=None, compress=False): # упаковка сообщения в кадр <длина>[<id>]<данные>
+    payload = message.encode() if isinstance(message, str) else message
+    length = len(payload)
+    if compress and length >= COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload)
+        length = len(payload) | COMPRESSED
+    if request_id is None:
+        return HEADER.pack(length) + payload
+    return TAGGED_HEADER.pack(length, request_id) + payload
+
+class FrameReader: # чтение кадров из сокета без лишних копирований
+    def __init__(self, sock):
+        self.sock = sock
+        self.header = bytearray(HEADER.size)
+        self.tagged_header = bytearray(TAGGED_HEADER.size)
+        self.received = 0 # размер последнего кадра на проводе, с заголовком
+
+    def read_exact(self, buffer): # заполнить буфер целиком, данные пишутся сразу на место
+        view = memoryview(buffer)
+        while view:
+            received = self.sock.recv_into(view)
+            if not received:
+                raise ConnectionError('server closed connection')
+            view = view[received:]
+
+    def read_length(self):
+        self.read_exact(self.header)
+        length = HEADER.unpack(self.header)[0]
+        self.received = HEADER.size + (length & ~COMPRESSED)
+        return length
+
+    def read_frame(self): # весь кадр одним буфером нужного размера
+        return self.read_body(self.read_length())
+
+    def read_tagged_frame(self): # -> (номер запроса, данные)
+        self.read_exact(self.tagged_header)
+        length, request_id = TAGGED_HEADER.unpack(self.tagged_header)
+        self.received = TAGGED_HEADER.size + (length & ~COMPRESSED)
+        return request_id, self.read_body(length)
+
+    def read_body(self, length):
+        if length & COMPRESSED:
+            frame = bytearray()
+            for chunk in self.iter_body(length):
+                frame += chunk
+            return frame
+        frame = bytearray(length)
+        self.read_exact(frame)
+        return frame
+
+    def iter_body(self, length, chunk_size=CHUNK_SIZE): # сжатые данные распаковываются по мере прихода
+        decompressor = zlib.decompressobj() if length & COMPRESSED else None
+        remaining = length & ~COMPRESSED
+        view = memoryview(bytearray(min(chunk_size, remaining)))
+        while remaining: # буфер переиспользуется, кусок нужно обработать до следующей итерации
+            size = min(len(view), remaining)
+            self.read_exact(view[:size])
+            remaining -= size
+            if decompressor:
+                yield decompressor.decompress(view[:size])
+            else:
+                yield view[:size]
+        if decompressor:
+            yield decompressor.flush()
+
+class ServerConnection: # соединение с сервером, весь обмен по сокету идет в отдельном потоке
+    def __init__(self):
+        self.sock = None
+        self.requests = queue.Queue()
+        self.worker = None
+        self.reader = None
+        self.features = set()
+        self.framed = False
+        self.tagged = False
+        self.compress = False
+        self.listener = None
+        self.listening = False
+        self.closing = False
+        self.pending = {} # id запроса -> Future, ожидающие ответа в режиме конвейера
+        self.pending_lock = threading.Lock()
+        self.last_id = 0
+        self.address = None
+        self.online = False # без связи запросы сразу получают None
+        self.reconnecting = False
+        self.on_online = None # вызывается из потока переподключения, когда связь восстановлена
+
+    def start(self, address, on_online=None): # подключение без падения: без сервера работаем офлайн и пробуем снова в фоне
+        self.address = address
+        self.on_online = on_online
+        try:
+            self.connect(address)
+        except OSError as e:
+            print(f"Error connecting to server: {e}")
+            self.lost()
+        return self.online
+
+    def connect(self, address): # подключение и запуск сетевого потока
+        self.address = address
+        self.sock = socket.create_connection(address)
+        self.reader = FrameReader(self.sock)
+        self.closing = False
+        self.negotiate()
+        if self.tagged: # ответы читает отдельный поток, запросы уходят не дожидаясь их
+            self.listening = True
+            self.listener = threading.Thread(target=self.listen, name='server-listener', daemon=True)
+            self.listener.start()
+        self.worker = threading.Thread(target=self.run, name='server-connection', daemon=True)
+        self.worker.start()
+        self.online = True
+
+    def lost(self): # связь потеряна: соединение восстанавливается в отдельном потоке
+        self.online = False
+        with self.pending_lock:
+            if self.reconnecting or self.address is None:
+                return
+            self.reconnecting = True
+        threading.Thread(target=self.reconnect, name='server-reconnect', daemon=True).start()
+
+    def reconnect(self):
+        while True:
+            time.sleep(RECONNECT_INTERVAL)
+            if self.sock: # сетевой поток мог зависнуть на полуоткрытом сокете
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.close() # потоки старого соединения
+            try:
+                self.connect(self.address)
+                break
+            except OSError:
+                continue
+        with self.pending_lock:
+            self.reconnecting = False
+        if self.on_online:
+            self.on_online()
+
+    def negotiate(self): # узнаем, какие возможности протокола поддерживает сервер
+        self.sock.settimeout(HANDSHAKE_TIMEOUT)
+        hello = f"hello {' '.join(CLIENT_FEATURES)}".encode()
+        start = time.perf_counter()
+        try:
+            self.sock.sendall(hello)
+            answer = self.sock.recv(65536).decode()
+            telemetry.record_request('hello', time.perf_counter() - start, len(hello), len(answer.encode()))
+        except socket.timeout:
+            answer = ''
+            telemetry.record_request('hello', time.perf_counter() - start, len(hello), failed=True)
+        finally:
+            self.sock.settimeout(None)
+
+        words = answer.split()
+        if words[:1] == ['hello']: # старый сервер ответит ошибкой, тогда остаемся на простом протоколе
+            self.features = set(words[1:]) & set(CLIENT_FEATURES)
+        self.framed = 'framed' in self.features
+        if not self.framed:
+            self.features -= FRAMED_FEATURES
+        self.tagged = 'tagged' in self.features
+        self.compress = 'zlib' in self.features
+
+    def submit(self, message, raw=False): # поставить запрос в очередь, ответ придет во Future
+        future = Future()                  # raw - вернуть ответ байтами, без декодирования в строку
+        if not self.online:
+            telemetry.record_request(command_verb(message), 0, failed=True)
+            future.set_result(None)
+            return future
+        self.requests.put((message, future, raw))
+        return future
+
+    def request(self, message, raw=False): # блокирующий запрос (не вызывать из потока интерфейса)
+        return self.submit(message, raw).result()
+
+    def run(self): # цикл сетевого потока: запросы отправляются в порядке постановки в очередь
+        while True:
+            message, future, raw = self.requests.get()
+            if message is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self.tagged:
+                self.send_tagged(message, future, raw)
+            else:
+                future.set_result(self.exchange(message, raw))
+
+    def send_tagged(self, message, future, raw): # отправка с номером запроса, ответ найдет свой Future сам
+        self.last_id = (self.last_id + 1) & 0xFFFFFFFF
+        verb = command_verb(message)
+        frame = encode_frame(message, self.last_id, self.compress)
+        with self.pending_lock:
+            if not self.listening: # поток чтения уже остановился из-за ошибки
+                telemetry.record_request(verb, 0, failed=True)
+                future.set_result(None)
+                return
+            self.pending[self.last_id] = (future, raw, verb, time.perf_counter(), len(frame))
+        try:
+            self.sock.sendall(frame)
+        except Exception as e:
+            print(f"Error communicating with server: {e}")
+            with self.pending_lock:
+                request = self.pending.pop(self.last_id, None)
+            if request: # иначе поток чтения уже завершил запрос
+                telemetry.record_request(verb, 0, len(frame), failed=True)
+                future.set_result(None)
+            self.lost()
+
+    def listen(self): # поток чтения ответов: раздает их ожидающим по номеру запроса
+        try:
+            while True:
+                request_id, frame = self.reader.read_tagged_frame()
+                with self.pending_lock:
+                    request = self.pending.pop(request_id, None)
+                if request:
+                    future, raw, verb, start, sent = request
+                    telemetry.record_request(verb, time.perf_counter() - start, sent, self.reader.received)
+                    future.set_result(frame if raw else frame.decode())
+        except Exception as e:
+            if not self.closing:
+                print(f"Error communicating with server: {e}")
+        with self.pending_lock:
+            self.listening = False
+            pending, self.pending = self.pending, {}
+        for future, raw, verb, start, sent in pending.values():
+            telemetry.record_request(verb, time.perf_counter() - start, sent, failed=True)
+            future.set_result(None)
+        if not self.closing:
+            self.lost()
+
+    def exchange(self, message, raw=False): # отправка сообщения на сервер и получение ответа
+        verb = command_verb(message)
+        start = time.perf_counter()
+        sent = 0
+        try:
+            if self.framed:
+                data = encode_frame(message, compress=self.compress)
+                self.sock.sendall(data)
+                sent = len(data)
+                frame = self.reader.read_frame()
+                telemetry.record_request(verb, time.perf_counter() - start, sent, self.reader.received)
+                return frame if raw else frame.decode()
+            data = message.encode()
+            self.sock.sendall(data)
+            sent = len(data)
+            response = self.sock.recv(65536)
+            if not response:
+                raise ConnectionError('server closed connection')
+            telemetry.record_request(verb, time.perf_counter() - start, sent, len(response))
+            return response.decode()
+        except Exception as e:
+            print(f"Error communicating with server: {e}")
+            telemetry.record_request(verb, time.perf_counter() - start, sent, failed=True)
+            if not self.closing:
+                self.lost()
+
+    def close(self): # остановка сетевых потоков и закрытие сокета
+        self.closing = True
+        self.online = False
+        if self.worker:
+            self.requests.put((None, None, False))
+            self.worker.join()
+            self.worker = None
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR) # разбудит поток чтения
+            except OSError:
+                pass
+            if self.listener:
+                self.listener.join()
+                self.listener = None
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,297 @@
+import gc
+import re
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
+from itertools import accumulate
+from operator import attrgetter
+from sys import intern
+
+CONTACT_FIELDS = ('surname', 'name', 'patronymic', 'birth_date', 'city', 'street',
+                  'house_number', 'apartment_number', 'phone')
+
+class Contact: # компактная запись контакта: без __dict__, повторяющиеся строки интернированы
+    __slots__ = CONTACT_FIELDS
+
+    def __init__(self, surname, name, patronymic, birth_date, city, street, house_number, apartment_number, phone):
+        self.surname = intern(surname)
+        self.name = intern(name)
+        self.patronymic = intern(patronymic)
+        self.birth_date = intern(birth_date)
+        self.city = intern(city)
+        self.street = intern(street)
+        self.house_number = intern(house_number)
+        self.apartment_number = intern(apartment_number)
+        self.phone = phone # номера уникальны, интернировать их нет смысла
+
+    @classmethod
+    def from_interned(cls, surname, name, patronymic, birth_date, city, street, house_number, apartment_number, phone):
+        contact = object.__new__(cls) # значения уже из словаря двоичного ответа: без повторного intern, вдвое быстрее
+        contact.surname = surname
+        contact.name = name
+        contact.patronymic = patronymic
+        contact.birth_date = birth_date
+        contact.city = city
+        contact.street = street
+        contact.house_number = house_number
+        contact.apartment_number = apartment_number
+        contact.phone = phone
+        return contact
+
+    @classmethod
+    def from_dict(cls, contact): # из словаря, который возвращают диалоги
+        return cls(*(contact[field] for field in CONTACT_FIELDS))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in CONTACT_FIELDS}
+
+    def fields(self): # значения в порядке протокола
+        return [getattr(self, field) for field in CONTACT_FIELDS]
+
+    def title(self): # строка для списка контактов
+        return f"{self.surname} {self.name} {self.phone}"
+
+# Команды изменения данных в том виде, в котором их отправляет клиент
+def wire_name(name): # название события в команде: пробелы заменяются на '_'
+    return '_'.join(name.strip().split())
+
+def add_contact_command(login, contact):
+    return f"add_contact {login} {' '.join(contact.fields())}"
+
+def add_contacts_command(login, contacts): # пакет: записи через ';', поля через ','
+    return f"add_contacts {login} {';'.join(','.join(contact.fields()) for contact in contacts)}"
+
+def change_contact_command(login, old_phone, contact):
+    return f"change_contact {login} {old_phone} {' '.join(contact.fields())}"
+
+def remove_contact_command(login, phone):
+    return f'remove_contact {login} {phone}'
+
+def remove_contacts_command(login, phones):
+    return f"remove_contacts {login} {' '.join(phones)}"
+
+def add_event_command(login, date, name): # дата 'yyyy-MM-dd'
+    return f'add_event {login} {date} {wire_name(name)}'
+
+def change_event_command(login, date, old_name, new_name):
+    return f'change_event {login} {date} {wire_name(old_name)} {wire_name(new_name)}'
+
+def remove_event_command(login, date, name):
+    return f'remove_event {login} {date} {wire_name(name)}'
+
+def remove_events_command(login, date, names): # пакет: события одной даты
+    return f"remove_events {login} {date} {' '.join(map(wire_name, names))}"
+
+class ReplyError(ValueError): # сервер ответил текстом ошибки там, где ждали список
+    def __init__(self, reply):
+        super().__init__(reply)
+        self.reply = reply
+
+def text_reply(answer, binary): # -> ответ строкой, если он текстовый; None - двоичный список
+    if not binary:
+        return answer
+    if answer[:1].isalpha(): # двоичный список начинается с числа записей, его первый байт - 0
+        return bytes(answer).decode(errors='replace')
+    return None
+
+def read_contact_list(answer, binary): # ответ со списком контактов в согласованном формате
+    text = text_reply(answer, binary)
+    return decode_contacts(answer) if text is None else parse_contacts(text)
+
+def read_event_list(answer, binary):
+    text = text_reply(answer, binary)
+    return decode_events(answer) if text is None else parse_events(text)
+
+@contextmanager
+def gc_paused(): # в списке записей нет циклических ссылок, а сборщик мусора на каждой сотне тысяч новых объектов
+    enabled = gc.isenabled() # обходит все живые объекты, и разбор большого списка замедляется в разы
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def parse_contacts(answer): # ответ get_contacts: "поле,поле,...;поле,...;"
+    if not answer or answer == 'no contacts':
+        return []
+    if not answer.endswith(';'): # список всегда кончается на ';', ошибка - нет
+        raise ReplyError(answer)
+    with gc_paused():
+        return [Contact(*record.split(',')) for record in answer[:-1].split(';')]
+
+def parse_batch(answer, count): # ответ пакетной команды: "ok;ошибка;..." - по результату на каждый элемент
+    if not answer:
+        return None
+    results = answer[:-1].split(';') if answer.endswith(';') else answer.split(';')
+    return results if len(results) == count else None
+
+def parse_events(answer): # ответ get_events: "дата,событие,событие,;дата,событие,;" -> [(дата, событие)]
+    if not answer or answer == 'no events':
+        return []
+    if not answer.endswith(';'):
+        raise ReplyError(answer)
+    events = []
+    for record in answer[:-1].split(';'):
+        fields = record.split(',')[:-1]
+        if len(fields) >= 2:
+            date = fields[0]
+            events.extend((date, name.replace('_', ' ')) for name in fields[1:])
+    return events
+
+def split_delta(answer): # ответ *_since: "версия;+запись;-запись;", "версия*" - прислан полный снимок
+    if not answer:
+        return None
+    if not answer[:1].isdigit(): # ответ начинается с номера версии, иначе это ошибка
+        raise ReplyError(answer)
+    records = answer[:-1].split(';') if answer.endswith(';') else answer.split(';')
+    head = records[0]
+    return int(head.rstrip('*')), head.endswith('*'), records[1:]
+
+def parse_contacts_delta(answer): # -> (версия, сброс, [('+', контакт) или ('-', телефон)]) в порядке сервера
+    delta = split_delta(answer)
+    if delta is None:
+        return None
+    version, reset, records = delta
+    changes = []
+    for record in records:
+        if record[:1] == '+':
+            changes.append(('+', Contact(*record[1:].split(','))))
+        elif record[:1] == '-':
+            changes.append(('-', record[1:]))
+    return version, reset, changes
+
+def parse_events_delta(answer): # -> (версия, сброс, [('+' или '-', дата, название)]) в порядке сервера
+    delta = split_delta(answer)
+    if delta is None:
+        return None
+    version, reset, records = delta
+    changes = []
+    for record in records:
+        date, _, name = record[1:].partition(',')
+        if record[:1] in ('+', '-'):
+            changes.append((record[:1], date, name.replace('_', ' ')))
+    return version, reset, changes
+
+# Двоичный формат ответов get_contacts/get_contacts_page/get_events (возможность 'binary').
+# Контакты: повторяющиеся значения (фамилии, имена, города, улицы, дома, квартиры) лежат один раз в словаре,
+# запись хранит только номера в словаре, даты упакованы в фиксированные 4 байта, разделителей между полями нет:
+#     COUNTS: записей, строк словаря, дат словаря, байт на номер строки (2 или 4)
+#     длины строк словаря в символах (H), размер блока в байтах (I) и сами строки одним блоком utf-8
+#     даты словаря (CONTACT_DATE, год 0 - дата не указана); если какую-то дату так не упаковать (старые записи
+#     в другом формате), вместо числа дат передается TEXT_DATES, и даты рождения идут через словарь строк
+#     номера строк по столбцам, по столбцу на каждое поле из TABLE_FIELDS, затем столбец номеров дат
+#     так же - телефоны: длины, размер блока и блок
+# Блоки декодируются одним вызовом и режутся по длинам, столбцы номеров читает array на C.
+FIELD_SEPARATOR = '\x1f' # разделитель названий событий
+COUNT = struct.Struct('!I') # число дат событий, размер блока строк
+COUNTS = struct.Struct('!IIIB')
+CONTACT_DATE = struct.Struct('!HBB') # год, месяц, день
+EVENT_DATE = struct.Struct('!HBBH') # год, месяц, день, сколько событий в эту дату
+TABLE_FIELDS = ('surname', 'name', 'patronymic', 'city', 'street', 'house_number', 'apartment_number')
+TEXT_DATES = 0xFFFFFFFF
+ISO_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})', re.ASCII)
+
+def packed_date(date): # 'yyyy-MM-dd' -> (год, месяц, день), '' -> (0, 0, 0); None - так дату не передать без искажений
+    if not date:
+        return 0, 0, 0
+    match = ISO_DATE.fullmatch(date)
+    if match is None or match.group(1) == '0000':
+        return None
+    return tuple(map(int, match.groups()))
+
+def pack_array(typecode, values): # числа в сетевом порядке байт
+    numbers = array(typecode, values)
+    if sys.byteorder == 'little':
+        numbers.byteswap()
+    return numbers.tobytes()
+
+def unpack_array(typecode, view, offset, count): # -> (числа, смещение за ними)
+    numbers = array(typecode)
+    end = offset + count * numbers.itemsize
+    numbers.frombytes(view[offset:end])
+    if sys.byteorder == 'little':
+        numbers.byteswap()
+    return numbers, end
+
+def pack_strings(values): # -> длины в символах, размер блока в байтах и блок utf-8
+    block = ''.join(values).encode()
+    return pack_array('H', map(len, values)) + COUNT.pack(len(block)) + block
+
+def unpack_strings(view, offset, count): # -> (строки, смещение за ними); блок декодируется целиком и режется по длинам
+    lengths, offset = unpack_array('H', view, offset, count)
+    size, = COUNT.unpack_from(view, offset)
+    offset += COUNT.size
+    block = str(view[offset:offset + size], 'utf-8')
+    return [block[end - length:end] for end, length in zip(accumulate(lengths), lengths)], offset + size
+
+def encode_contacts(contacts):
+    table = {} # строка -> номер в словаре
+    dates = {} # дата -> номер в словаре дат
+    columns = [[table.setdefault(value, len(table)) for value in map(attrgetter(field), contacts)] for field in TABLE_FIELDS]
+    birth_dates = [dates.setdefault(contact.birth_date, len(dates)) for contact in contacts]
+    packed = list(map(packed_date, dates))
+    if None in packed:
+        birth_dates = [table.setdefault(contact.birth_date, len(table)) for contact in contacts]
+    columns.append(birth_dates)
+    dates_size = TEXT_DATES if None in packed else len(dates)
+    index_code = 'H' if max(len(table), len(dates)) <= 0xFFFF else 'I'
+    parts = [COUNTS.pack(len(contacts), len(table), dates_size, array(index_code).itemsize), pack_strings(list(table))]
+    if dates_size != TEXT_DATES:
+        parts.extend(CONTACT_DATE.pack(*date) for date in packed)
+    parts.extend(pack_array(index_code, column) for column in columns)
+    parts.append(pack_strings([contact.phone for contact in contacts]))
+    return b''.join(parts)
+
+def decode_contacts(data): # записи собираются прямо из столбцов, без промежуточной матрицы строк
+    view = memoryview(data)
+    count, table_size, dates_size, index_size = COUNTS.unpack_from(view)
+    if not count:
+        return []
+    with gc_paused():
+        return read_contact_columns(view, count, table_size, dates_size, index_size)
+
+def read_contact_columns(view, count, table_size, dates_size, index_size):
+    table, offset = unpack_strings(view, COUNTS.size, table_size)
+    table = list(map(intern, table))
+    if dates_size == TEXT_DATES:
+        dates = table
+    else:
+        dates = [intern('%04d-%02d-%02d' % date) if date[0] else ''
+                 for date in CONTACT_DATE.iter_unpack(view[offset:offset + dates_size * CONTACT_DATE.size])]
+        offset += dates_size * CONTACT_DATE.size
+    index_code = 'H' if index_size == 2 else 'I'
+    columns = {}
+    for field in TABLE_FIELDS:
+        indexes, offset = unpack_array(index_code, view, offset, count)
+        columns[field] = map(table.__getitem__, indexes)
+    indexes, offset = unpack_array(index_code, view, offset, count)
+    columns['birth_date'] = map(dates.__getitem__, indexes)
+    columns['phone'], offset = unpack_strings(view, offset, count)
+    return list(map(Contact.from_interned, *(columns[field] for field in CONTACT_FIELDS)))
+
+def encode_events(events): # [(дата 'yyyy-MM-dd', название)], события одной даты идут подряд
+    dates = []
+    for date, name in events:
+        if dates and dates[-1][0] == date:
+            dates[-1][1] += 1
+        else:
+            dates.append([date, 1])
+    parts = [COUNT.pack(len(dates))]
+    parts.extend(EVENT_DATE.pack(*map(int, date.split('-')), count) for date, count in dates)
+    parts.append(FIELD_SEPARATOR.join(name for date, name in events).encode())
+    return b''.join(parts)
+
+def decode_events(data): # -> [(дата, название)], как parse_events
+    view = memoryview(data)
+    count, = COUNT.unpack_from(view)
+    if not count:
+        return []
+    start = COUNT.size + count * EVENT_DATE.size
+    names = iter(str(view[start:], 'utf-8').split(FIELD_SEPARATOR))
+    events = []
+    for year, month, day, size in EVENT_DATE.iter_unpack(view[COUNT.size:start]):
+        date = f'{year:04d}-{month:02d}-{day:02d}'
+        events.extend((date, next(names)) for _ in range(size))
+    return events
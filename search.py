@@ -0,0 +1,247 @@
+import re
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from sys import intern
+from itertools import chain, compress, islice, repeat
+from operator import attrgetter, contains, itemgetter
+
+from validation import normalize_phone
+
+SLOT_SIZE = 16 # место под один номер в буфере поиска по телефонам
+SLOT_FILLER = b'\n' # заполнитель слота: совпадение не может перейти на соседний номер
+SHORT_QUERY = 3 # под такой короткий кусок номера подходит большая часть контактов, проще перебрать все
+MERGE_ONE_BY_ONE = 256 # столько отложенных контактов вставляются в слова по одному, больше - сортировка кусками
+SORT_CHUNK = 2000 # контактов в одном куске сортировки: кусок раскладывается за несколько мс и не подвешивает интерфейс
+SEGMENT_WORDS = 1 << 15 # больше слов соседние куски не сливаются, чтобы слияние тоже оставалось коротким
+WORD_SET_LIMIT = 4096 # для следующих слов запроса до стольких контактов собираются в множество, иначе проверяется каждый найденный
+PREFIX_END = chr(0x10FFFF) # больше любого символа: граница диапазона слов с общим началом
+
+class ContactIndex: # индекс для поиска по мере ввода, обновляется по одному контакту
+    # Слова лежат в нескольких отсортированных кусках: пачка контактов раскладывается кусками в простое интерфейса,
+    # а поиск сливает подходящие диапазоны кусков по мере показа строк. search() возвращает ленивый итератор,
+    # он действителен, пока индекс не меняется: перед изменением вызывающий дочитывает его до конца.
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.contacts = {} # приведенный номер телефона -> контакт, в порядке добавления; по нему же ищутся повторы номеров
+        self.segments = [] # куски [слова, контакты]: слова (фамилия, имя, отчество в нижнем регистре) отсортированы внутри куска,
+                           # контакт для каждого слова лежит параллельно
+        self.unsorted = {} # контакты, добавленные пачкой: их слова разложатся перед первым поиском
+        self.slots = bytearray() # номера в слотах по SLOT_SIZE байт, по буферу ищет re на C
+        self.slot_contacts = [] # номер слота -> контакт, None у освободившегося слота
+        self.phone_slots = {} # приведенный номер -> номер слота
+        self.free_slots = []
+        self.forget_search()
+
+    def forget_search(self): # после изменения индекса прошлый результат поиска по номеру не годится для сужения
+        self.last_digits = None
+        self.last_phones = []
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def __contains__(self, phone): # номер в любой записи: '+7 912 ...' и '+7912...' - один и тот же
+        return normalize_phone(phone) in self.contacts
+
+    def get(self, phone):
+        return self.contacts.get(normalize_phone(phone))
+
+    def values(self):
+        return self.contacts.values()
+
+    def add(self, contact): # добавить контакт или заменить контакт с тем же номером на том же месте
+        self.forget_search()
+        phone = normalize_phone(contact.phone)
+        old = self.contacts.get(phone)
+        if old is not None:
+            self.remove_words(old)
+        self.contacts[phone] = contact
+        if self.unsorted:
+            self.unsorted[contact] = None
+        else:
+            self.insert_words(contact)
+        self.put_slot(phone, contact)
+
+    def extend(self, contacts): # пачка контактов: номера ищутся сразу, слова раскладываются потом одним разом
+        self.forget_search()
+        for contact in contacts:
+            phone = normalize_phone(contact.phone)
+            old = self.contacts.get(phone)
+            if old is not None:
+                self.remove_words(old)
+            self.contacts[phone] = contact
+            self.unsorted[contact] = None
+            self.put_slot(phone, contact)
+
+    def remove(self, phone):
+        phone = normalize_phone(phone)
+        contact = self.contacts.pop(phone, None)
+        if contact is None:
+            return None
+        self.forget_search()
+        self.remove_words(contact)
+        slot = self.phone_slots.pop(phone)
+        start = slot * SLOT_SIZE
+        self.slots[start:start + SLOT_SIZE] = SLOT_FILLER * SLOT_SIZE
+        self.slot_contacts[slot] = None
+        self.free_slots.append(slot)
+        return contact
+
+    def put_slot(self, phone, contact): # у замененного контакта номер остается в своем слоте
+        slot = self.phone_slots.get(phone)
+        if slot is None:
+            slot = self.free_slots.pop() if self.free_slots else len(self.slot_contacts)
+            self.phone_slots[phone] = slot
+        if slot == len(self.slot_contacts):
+            self.slot_contacts.append(contact)
+            self.slots += slot_value(phone)
+        else:
+            self.slot_contacts[slot] = contact
+            start = slot * SLOT_SIZE
+            self.slots[start:start + SLOT_SIZE] = slot_value(phone)
+
+    def insert_words(self, contact): # одиночный контакт - в последний кусок
+        if not self.segments or len(self.segments[-1][0]) >= SEGMENT_WORDS:
+            self.segments.append([[], []])
+        keys, contacts = self.segments[-1]
+        for word in contact_words(contact):
+            position = bisect_right(keys, word)
+            keys.insert(position, word)
+            contacts.insert(position, contact)
+
+    def remove_words(self, contact):
+        if contact in self.unsorted: # слова контакта еще не разложены
+            del self.unsorted[contact]
+            return
+        for word in contact_words(contact):
+            for keys, contacts in self.segments:
+                first = bisect_left(keys, word)
+                last = bisect_right(keys, word, first)
+                if first < last and contact in contacts[first:last]:
+                    position = contacts.index(contact, first, last)
+                    del keys[position]
+                    del contacts[position]
+                    break
+
+    def sort_words(self, limit=None): # разложить отложенные слова: перед поиском - все, в простое интерфейса - не больше limit
+        if not self.unsorted:         # контактов за вызов; возвращает True, если отложенных не осталось
+            return True
+        if len(self.unsorted) <= MERGE_ONE_BY_ONE:
+            unsorted, self.unsorted = self.unsorted, {}
+            for contact in unsorted:
+                self.insert_words(contact)
+            return True
+        left = len(self.unsorted) if limit is None else limit
+        while self.unsorted and left > 0:
+            contacts = list(islice(self.unsorted, min(SORT_CHUNK, left)))
+            for contact in contacts:
+                del self.unsorted[contact]
+            self.add_segment(contacts)
+            left -= len(contacts)
+        return not self.unsorted
+
+    def add_segment(self, contacts): # новый кусок; соседние куски близкого размера сливаются, пока не станут большими
+        words = sorted((word, position) for position, contact in enumerate(contacts) for word in contact_words(contact))
+        self.segments.append([[word for word, position in words], [contacts[position] for word, position in words]])
+        while len(self.segments) > 1:
+            (keys, owners), (new_keys, new_owners) = self.segments[-2:]
+            if len(keys) > 2 * len(new_keys) or len(keys) + len(new_keys) > SEGMENT_WORDS:
+                break
+            keys = keys + new_keys
+            owners = owners + new_owners
+            order = sorted(range(len(keys)), key=keys.__getitem__) # два готовых отрезка: сортировка сводится к слиянию на C
+            self.segments[-2:] = [[list(map(keys.__getitem__, order)), list(map(owners.__getitem__, order))]]
+
+    def search(self, text): # контакты, подходящие под все слова запроса, - итератор, строки разбираются по мере показа
+        terms = text.lower().split()
+        if not terms:
+            return iter(self.contacts.values())
+        found = self.find_term(terms[0])
+        for term in terms[1:]:
+            digits = term.lstrip('+')
+            if digits.isdigit(): # номер проверяется прямо у найденных
+                found = keep_phones(found, digits)
+            else:
+                ranges = self.prefix_ranges(term)
+                if sum(last - first for keys, contacts, first, last in ranges) <= WORD_SET_LIMIT:
+                    contacts = set(chain.from_iterable(contacts[first:last] for keys, contacts, first, last in ranges))
+                    found = filter(contacts.__contains__, found)
+                else: # под слово подходит много контактов - проверяются сами найденные, по мере показа
+                    found = keep_words(found, term)
+        return iter(found)
+
+    def find_term(self, term): # -> контакты без повторов
+        digits = term.lstrip('+')
+        if digits.isdigit():
+            return self.find_phones(digits)
+        return unique(self.prefix_matches(term))
+
+    def prefix_ranges(self, prefix): # начало фамилии, имени или отчества: в каждом куске двоичный поиск
+        self.sort_words()            # -> [(слова, контакты, начало, конец)]
+        ranges = []
+        for keys, contacts in self.segments:
+            first = bisect_left(keys, prefix)
+            last = bisect_left(keys, prefix + PREFIX_END, first)
+            if first < last:
+                ranges.append((keys, contacts, first, last))
+        return ranges
+
+    def prefix_matches(self, prefix): # контакты подходящих слов по алфавиту слов; контакт встречается по разу на каждое слово
+        ranges = self.prefix_ranges(prefix)
+        if len(ranges) == 1:
+            keys, contacts, first, last = ranges[0]
+            return map(contacts.__getitem__, range(first, last))
+        words = (zip(map(keys.__getitem__, range(first, last)), map(contacts.__getitem__, range(first, last)))
+                 for keys, contacts, first, last in ranges)
+        return map(itemgetter(1), merge(*words, key=itemgetter(0)))
+
+    def find_phones(self, digits): # кусок номера телефона
+        if self.last_digits and self.last_digits in digits and len(self.last_phones) * 4 < len(self.contacts):
+            found = filter_phones(self.last_phones, digits) # при наборе номера результат только сужается
+        elif len(digits) < SHORT_QUERY: # подходит большая часть контактов: перебираем все по мере показа, без цикла на python
+            self.forget_search()
+            return compress(self.contacts.values(), map(contains, self.contacts, repeat(digits)))
+        else:
+            slot_contacts = self.slot_contacts
+            found = list(dict.fromkeys(slot_contacts[match.start() // SLOT_SIZE]
+                                       for match in re.finditer(re.escape(digits.encode()), self.slots)))
+        self.last_digits, self.last_phones = digits, found
+        return found
+
+    def matches(self, contact, text): # подходит ли один контакт под запрос, без обращения к индексу
+        words = contact_words(contact)
+        for term in text.lower().split():
+            digits = term.lstrip('+')
+            if digits.isdigit():
+                if digits not in contact.phone:
+                    return False
+            elif not any(word.startswith(term) for word in words):
+                return False
+        return True
+
+def contact_words(contact): # слова, по началу которых ищется контакт; одинаковые строки хранятся один раз
+    return {intern(word.lower()) for word in (contact.surname, contact.name, contact.patronymic) if word}
+
+def unique(contacts): # контакт, у которого подошло несколько слов, - один раз
+    seen = set()
+    for contact in contacts:
+        if contact not in seen:
+            seen.add(contact)
+            yield contact
+
+def keep_phones(contacts, digits): # ленивый отбор по куску номера
+    for contact in contacts:
+        if digits in contact.phone:
+            yield contact
+
+def keep_words(contacts, term):
+    for contact in contacts:
+        if any(word.startswith(term) for word in contact_words(contact)):
+            yield contact
+
+def filter_phones(contacts, digits):
+    return list(compress(contacts, map(contains, map(attrgetter('phone'), contacts), repeat(digits))))
+
+def slot_value(phone): # номер длиннее слота обрезается, по нему ищутся только первые цифры
+    return phone.encode()[:SLOT_SIZE - 1].ljust(SLOT_SIZE, SLOT_FILLER)
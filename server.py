@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import os
+import sqlite3
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from network import HEADER, TAGGED_HEADER, COMPRESSED, CLIENT_FEATURES, FRAMED_FEATURES, encode_frame
+from protocol import CONTACT_FIELDS, Contact, encode_contacts, encode_events
+
+# Эталонный сервер протокола клиента: все команды и расширения (hello, кадры, номера запросов,
+# сжатие, двоичные ответы, страницы, изменения с версии, пакеты, диапазоны дат) на asyncio и SQLite.
+# Ответы совпадают со строками, которые ожидает клиент. Запуск: python server.py --port 5289
+
+DEFAULT_PORT = 5289
+LOG_LIMIT = 10000 # столько последних изменений хранится для *_since, более старая версия получает полный снимок
+MAX_MESSAGE = 64 * 1024 * 1024 # кадр больше этого считается ошибкой протокола
+
+SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS users (
+        login TEXT PRIMARY KEY,
+        salt TEXT NOT NULL,
+        password TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS contacts (
+        login TEXT NOT NULL,
+        {', '.join(f'{field} TEXT NOT NULL' for field in CONTACT_FIELDS)},
+        PRIMARY KEY (login, phone)
+    );
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        login TEXT NOT NULL,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS events_by_login ON events (login, date);
+    CREATE TABLE IF NOT EXISTS versions (
+        login TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (login, kind)
+    );
+    CREATE TABLE IF NOT EXISTS changes (
+        login TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        record TEXT NOT NULL,
+        PRIMARY KEY (login, kind, version)
+    );
+"""
+
+CONTACT_COLUMNS = ', '.join(CONTACT_FIELDS)
+INSERT_CONTACT = f"INSERT INTO contacts (login, {CONTACT_COLUMNS}) VALUES (?, {', '.join('?' * len(CONTACT_FIELDS))})"
+UPDATE_CONTACT = f"UPDATE contacts SET {', '.join(f'{field} = ?' for field in CONTACT_FIELDS)} WHERE login = ? AND phone = ?"
+REMOVE_EVENT = 'DELETE FROM events WHERE id = (SELECT id FROM events WHERE login = ? AND date = ? AND name = ? LIMIT 1)'
+
+DUPLICATE_CONTACT = 'contact with this phone number is already exists'
+
+def hash_password(salt, password):
+    return hashlib.sha256((salt + password).encode()).hexdigest()
+
+def contact_record(row): # строка таблицы -> запись протокола "поле,поле,..."
+    return ','.join(row)
+
+def events_text(rows): # [(дата, название)] по порядку дат -> "дата,событие,событие,;дата,событие,;"
+    parts = []
+    last_date = None
+    for date, name in rows:
+        if date != last_date:
+            if last_date is not None:
+                parts.append(';')
+            parts.append(date + ',')
+            last_date = date
+        parts.append(name + ',')
+    if parts:
+        parts.append(';')
+    return ''.join(parts)
+
+class Storage: # данные пользователей; каждый метод команды возвращает ответ клиенту
+    def __init__(self, path=':memory:'):
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False) # после создания - только из потока executor
+        self.executor = ThreadPoolExecutor(max_workers=1) # один поток: запросы к базе не держат цикл asyncio и идут по очереди
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def transaction(self):
+        return Transaction(self.db)
+
+    def execute(self, query, parameters=()):
+        return self.db.execute(query, parameters)
+
+    # версии и журнал изменений для get_contacts_since / get_events_since
+    def version(self, login, kind):
+        row = self.execute('SELECT version FROM versions WHERE login = ? AND kind = ?', (login, kind)).fetchone()
+        return row[0] if row else 0
+
+    def log(self, login, kind, records): # внутри транзакции команды
+        if not records:
+            return
+        version = self.version(login, kind)
+        self.db.executemany('INSERT INTO changes (login, kind, version, record) VALUES (?, ?, ?, ?)',
+                            ((login, kind, version + position, record) for position, record in enumerate(records, 1)))
+        version += len(records)
+        self.execute('INSERT OR REPLACE INTO versions (login, kind, version) VALUES (?, ?, ?)', (login, kind, version))
+        if version % LOG_LIMIT < len(records): # старые изменения чистятся раз в LOG_LIMIT версий
+            self.execute('DELETE FROM changes WHERE login = ? AND kind = ? AND version <= ?', (login, kind, version - LOG_LIMIT))
+
+    def delta(self, login, kind, since, snapshot): # "версия;+запись;-запись;" или "версия*;+запись;..." - полный снимок
+        version = self.version(login, kind)
+        if since == version:
+            return f'{version};'
+        oldest = self.execute('SELECT MIN(version) FROM changes WHERE login = ? AND kind = ?', (login, kind)).fetchone()[0]
+        if since <= 0 or since > version or oldest is None or since < oldest - 1:
+            return f'{version}*;' + ''.join(f'+{record};' for record in snapshot(login))
+        rows = self.execute('SELECT record FROM changes WHERE login = ? AND kind = ? AND version > ? ORDER BY version',
+                            (login, kind, since))
+        return f'{version};' + ''.join(f'{record};' for record, in rows)
+
+    def contact_records(self, login):
+        return map(contact_record, self.execute(f'SELECT {CONTACT_COLUMNS} FROM contacts WHERE login = ? ORDER BY rowid', (login,)))
+
+    def event_records(self, login):
+        return (f'{date},{name}' for date, name in self.execute('SELECT date, name FROM events WHERE login = ? ORDER BY id', (login,)))
+
+    # учетные записи
+    def login(self, login, password):
+        row = self.execute('SELECT salt, password FROM users WHERE login = ?', (login,)).fetchone()
+        if row is None:
+            return 'wrong login'
+        if hash_password(row[0], password) != row[1]:
+            return 'wrong password'
+        return 'successful login'
+
+    def register(self, login, password, confirm_password):
+        if password != confirm_password:
+            return 'passwords do not match'
+        salt = os.urandom(8).hex()
+        try:
+            self.execute('INSERT INTO users (login, salt, password) VALUES (?, ?, ?)', (login, salt, hash_password(salt, password)))
+        except sqlite3.IntegrityError:
+            return 'login already exists'
+        return 'successful register'
+
+    def change_password(self, login, password):
+        salt = os.urandom(8).hex()
+        if not self.execute('UPDATE users SET salt = ?, password = ? WHERE login = ?', (salt, hash_password(salt, password), login)).rowcount:
+            return 'wrong login'
+        return 'successful change_password'
+
+    # контакты
+    def get_contacts(self, login, binary):
+        rows = self.execute(f'SELECT {CONTACT_COLUMNS} FROM contacts WHERE login = ? ORDER BY rowid', (login,)).fetchall()
+        return self.contacts_answer(rows, binary)
+
+    def get_contacts_page(self, login, offset, count, binary):
+        rows = self.execute(f'SELECT {CONTACT_COLUMNS} FROM contacts WHERE login = ? ORDER BY rowid LIMIT ? OFFSET ?',
+                            (login, count, offset)).fetchall()
+        return self.contacts_answer(rows, binary)
+
+    def contacts_answer(self, rows, binary):
+        if binary: # пустой список тоже в двоичном виде, клиент разбирает ответ одним способом
+            return encode_contacts([Contact(*row) for row in rows])
+        return ''.join(contact_record(row) + ';' for row in rows) or 'no contacts'
+
+    def add_contacts(self, login, contacts): # -> ответ на каждый контакт, все в одной транзакции
+        results = []
+        records = []
+        with self.transaction():
+            for fields in contacts:
+                if len(fields) != len(CONTACT_FIELDS):
+                    results.append('wrong command format')
+                    continue
+                try:
+                    self.execute(INSERT_CONTACT, [login] + fields)
+                except sqlite3.IntegrityError:
+                    results.append(DUPLICATE_CONTACT)
+                    continue
+                results.append('ok')
+                records.append('+' + ','.join(fields))
+            self.log(login, 'contacts', records)
+        return results
+
+    def remove_contacts(self, login, phones):
+        results = []
+        records = []
+        with self.transaction():
+            for phone in phones:
+                if self.execute('DELETE FROM contacts WHERE login = ? AND phone = ?', (login, phone)).rowcount:
+                    results.append('ok')
+                    records.append('-' + phone)
+                else:
+                    results.append('no such contact')
+            self.log(login, 'contacts', records)
+        return results
+
+    def change_contact(self, login, old_phone, fields):
+        new_phone = fields[-1]
+        with self.transaction():
+            if new_phone != old_phone and self.execute('SELECT 1 FROM contacts WHERE login = ? AND phone = ?', (login, new_phone)).fetchone():
+                return DUPLICATE_CONTACT
+            if not self.execute(UPDATE_CONTACT, fields + [login, old_phone]).rowcount:
+                return 'no such contact'
+            self.log(login, 'contacts', ['-' + old_phone, '+' + ','.join(fields)])
+        return 'successful change_contact'
+
+    # события: названия хранятся так, как приходят в командах (пробелы заменены на '_')
+    def get_events(self, login, first, last, binary):
+        if first is None:
+            rows = self.execute('SELECT date, name FROM events WHERE login = ? ORDER BY date, id', (login,)).fetchall()
+        else:
+            rows = self.execute('SELECT date, name FROM events WHERE login = ? AND date BETWEEN ? AND ? ORDER BY date, id',
+                                (login, first, last)).fetchall()
+        if binary:
+            return encode_events([(date, name.replace('_', ' ')) for date, name in rows])
+        return events_text(rows) or 'no events'
+
+    def add_event(self, login, date, name):
+        with self.transaction():
+            self.execute('INSERT INTO events (login, date, name) VALUES (?, ?, ?)', (login, date, name))
+            self.log(login, 'events', [f'+{date},{name}'])
+        return 'successful add_event'
+
+    def remove_events(self, login, date, names):
+        results = []
+        records = []
+        with self.transaction():
+            for name in names:
+                if self.execute(REMOVE_EVENT, (login, date, name)).rowcount:
+                    results.append('ok')
+                    records.append(f'-{date},{name}')
+                else:
+                    results.append('no such event')
+            self.log(login, 'events', records)
+        return results
+
+    def change_event(self, login, date, old_name, new_name):
+        with self.transaction():
+            if not self.execute('UPDATE events SET name = ? WHERE id = (SELECT id FROM events WHERE login = ? AND date = ? AND name = ? LIMIT 1)',
+                                (new_name, login, date, old_name)).rowcount:
+                return 'no such event'
+            self.log(login, 'events', [f'-{date},{old_name}', f'+{date},{new_name}'])
+        return 'successful change_event'
+
+class Transaction: # BEGIN ... COMMIT, откат при исключении
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN')
+
+    def __exit__(self, kind, value, traceback):
+        self.db.execute('ROLLBACK' if kind else 'COMMIT')
+
+def event_date(value): # дата события строго 'yyyy-MM-dd': с другой сломался бы двоичный список событий
+    if len(value) != 10:
+        raise ValueError(value)
+    datetime.date.fromisoformat(value)
+    return value
+
+def record_fields(values): # поля записи протокола: ',' и ';' внутри поля сломали бы списки контактов и событий
+    for value in values:
+        if ',' in value or ';' in value:
+            raise ValueError(value)
+    return values
+
+def batch_answer(results):
+    return ''.join(result + ';' for result in results)
+
+COMMANDS = {'login', 'register', 'change_password', 'get_contacts', 'get_contacts_page', 'get_contacts_since',
+            'add_contact', 'add_contacts', 'change_contact', 'remove_contact', 'remove_contacts',
+            'get_events', 'get_events_since', 'add_event', 'change_event', 'remove_event', 'remove_events'}
+
+def handle_command(storage, message, binary=False): # строка команды -> ответ (str или bytes для двоичных списков)
+    words = message.split(' ')
+    command, args = words[0], words[1:]
+    count = len(args)
+    try:
+        if command == 'login' and count == 2:
+            return storage.login(*args)
+        if command == 'register' and count == 3:
+            return storage.register(*args)
+        if command == 'change_password' and count == 2:
+            return storage.change_password(*args)
+        if command == 'get_contacts' and count == 1:
+            return storage.get_contacts(args[0], binary)
+        if command == 'get_contacts_page' and count == 3:
+            return storage.get_contacts_page(args[0], int(args[1]), int(args[2]), binary)
+        if command == 'get_contacts_since' and count == 2:
+            return storage.delta(args[0], 'contacts', int(args[1]), storage.contact_records)
+        if command == 'add_contact' and count == 1 + len(CONTACT_FIELDS):
+            result, = storage.add_contacts(args[0], [record_fields(args[1:])])
+            return 'successful add_contact' if result == 'ok' else result
+        if command == 'add_contacts' and count >= 2:
+            records = message.split(' ', 2)[2].split(';')
+            return batch_answer(storage.add_contacts(args[0], [record.split(',') for record in records]))
+        if command == 'change_contact' and count == 2 + len(CONTACT_FIELDS):
+            return storage.change_contact(args[0], args[1], record_fields(args[2:]))
+        if command == 'remove_contact' and count == 2:
+            result, = storage.remove_contacts(args[0], args[1:])
+            return 'successful remove_contact' if result == 'ok' else result
+        if command == 'remove_contacts' and count >= 2:
+            return batch_answer(storage.remove_contacts(args[0], args[1:]))
+        if command == 'get_events' and count in (1, 3):
+            first, last = args[1:] if count == 3 else (None, None)
+            return storage.get_events(args[0], first, last, binary)
+        if command == 'get_events_since' and count == 2:
+            return storage.delta(args[0], 'events', int(args[1]), storage.event_records)
+        if command == 'add_event' and count == 3:
+            return storage.add_event(args[0], event_date(args[1]), *record_fields(args[2:]))
+        if command == 'change_event' and count == 4:
+            return storage.change_event(args[0], event_date(args[1]), *record_fields(args[2:]))
+        if command == 'remove_event' and count == 3:
+            result, = storage.remove_events(args[0], args[1], args[2:])
+            return 'successful remove_event' if result == 'ok' else result
+        if command == 'remove_events' and count >= 3:
+            return batch_answer(storage.remove_events(args[0], args[1], args[2:]))
+    except ValueError: # число или дата в неверном формате
+        return 'wrong command format'
+    if command in COMMANDS:
+        return 'wrong command format'
+    return 'unknown command'
+
+class Session: # одно соединение: до hello - простой протокол, после - согласованные возможности
+    def __init__(self, storage, reader, writer):
+        self.storage = storage
+        self.reader = reader
+        self.writer = writer
+        self.features = set()
+
+    async def run(self):
+        try:
+            while True:
+                if 'framed' in self.features:
+                    request_id, message = await self.read_frame()
+                else:
+                    request_id, message = None, await self.reader.read(65536)
+                    if not message:
+                        break
+                await self.answer(request_id, message.decode())
+        except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError, zlib.error):
+            pass
+        finally:
+            self.writer.close()
+
+    async def read_frame(self): # -> (номер запроса или None, данные)
+        if 'tagged' in self.features:
+            length, request_id = TAGGED_HEADER.unpack(await self.reader.readexactly(TAGGED_HEADER.size))
+        else:
+            (length,), request_id = HEADER.unpack(await self.reader.readexactly(HEADER.size)), None
+        if length & ~COMPRESSED > MAX_MESSAGE:
+            raise ConnectionError('frame too large')
+        data = await self.reader.readexactly(length & ~COMPRESSED)
+        if length & COMPRESSED:
+            data = zlib.decompress(data)
+        return request_id, data
+
+    async def answer(self, request_id, message):
+        if message.startswith('hello'): # ответ на hello всегда без кадра, дальше - выбранный формат
+            features = set(message.split()[1:]) & set(CLIENT_FEATURES)
+            if 'framed' not in features:
+                features -= FRAMED_FEATURES
+            self.writer.write(('hello ' + ' '.join(feature for feature in CLIENT_FEATURES if feature in features)).encode())
+            self.features = features
+        else:
+            reply = await asyncio.get_running_loop().run_in_executor(
+                self.storage.executor, handle_command, self.storage, message, 'binary' in self.features)
+            if 'framed' in self.features:
+                self.writer.write(encode_frame(reply, request_id, 'zlib' in self.features))
+            else:
+                self.writer.write(reply.encode() if isinstance(reply, str) else reply)
+        await self.writer.drain()
+
+async def serve(host, port, storage):
+    server = await asyncio.start_server(lambda reader, writer: Session(storage, reader, writer).run(), host, port)
+    print(f"Listening on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Эталонный сервер PeopleAndPlaces')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--db', default=':memory:', help="файл SQLite, по умолчанию данные только в памяти")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, Storage(args.db)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
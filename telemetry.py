@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from cache import default_cache_path
+
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000) # верхние границы корзин, мс; последняя - все, что дольше
+
+def default_dump_path(): # рядом с локальным кэшем, можно переопределить переменной окружения
+    return os.environ.get('PEOPLEANDPLACES_TELEMETRY') or os.path.join(os.path.dirname(default_cache_path()), 'telemetry.json')
+
+def command_verb(message): # 'add_contact login ...' -> 'add_contact'
+    if isinstance(message, (bytes, bytearray)):
+        message = bytes(message[:64]).decode(errors='replace')
+    return message.split(' ', 1)[0]
+
+class Histogram: # задержки по корзинам LATENCY_BUCKETS: память не растет с числом вызовов
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, milliseconds):
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.maximum:
+            self.maximum = milliseconds
+        self.buckets[bisect_left(LATENCY_BUCKETS, milliseconds)] += 1
+
+    def percentile(self, p): # оценка сверху: граница корзины, в которую попал p-й процентиль
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, size in zip(LATENCY_BUCKETS, self.buckets):
+            seen += size
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50), 3),
+            'p95_ms': round(self.percentile(95), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'max_ms': round(self.maximum, 3),
+            'buckets_ms': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['inf'], self.buckets)),
+        }
+
+class CommandStats: # одна команда протокола
+    __slots__ = ('latency', 'failures', 'bytes_sent', 'bytes_received')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+class Telemetry: # счетчики клиента; пишут сетевые потоки и поток интерфейса, читает панель отладки
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.commands = {} # команда -> CommandStats
+        self.parsing = {} # что разбиралось -> (Histogram времени, сколько записей всего)
+
+    def record_request(self, verb, seconds, sent=0, received=0, failed=False):
+        with self.lock:
+            stats = self.commands.get(verb)
+            if stats is None:
+                stats = self.commands[verb] = CommandStats()
+            if failed:
+                stats.failures += 1
+            else:
+                stats.latency.add(seconds * 1000)
+            stats.bytes_sent += sent
+            stats.bytes_received += received
+
+    def record_parse(self, name, seconds, items):
+        with self.lock:
+            histogram, total = self.parsing.get(name) or (Histogram(), 0)
+            histogram.add(seconds * 1000)
+            self.parsing[name] = (histogram, total + items)
+
+    def snapshot(self): # -> словарь для панели и JSON
+        with self.lock:
+            commands = {verb: {**stats.latency.as_dict(), 'failures': stats.failures,
+                               'bytes_sent': stats.bytes_sent, 'bytes_received': stats.bytes_received}
+                        for verb, stats in sorted(self.commands.items())}
+            parsing = {name: {**histogram.as_dict(), 'items': items} for name, (histogram, items) in sorted(self.parsing.items())}
+        return {'started': self.started, 'uptime': round(time.time() - self.started, 3), 'commands': commands, 'parsing': parsing}
+
+    def dump(self, path=None): # запись во временный файл и замена: читатель не увидит половину файла
+        path = path or default_dump_path()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False, indent=2)
+        os.replace(temporary, path)
+        return path
+
+    def timed_parse(self, name, parse, answer, count=len): # parse(answer) с замером; count(результат) - сколько записей разобрано
+        start = time.perf_counter()
+        result = parse(answer)
+        self.record_parse(name, time.perf_counter() - start, count(result) if result is not None else 0)
+        return result
+
+telemetry = Telemetry() # один набор счетчиков на процесс
@@ -0,0 +1,37 @@
+import io
+import unittest
+
+from exporter import EVENT_FIELDS, LINE_OCTETS, ICalendarExporter, fold_line
+
+def unfold(text): # обратное переносу по RFC 5545: CRLF с пробелом убираются
+    return text.replace('\r\n ', '')
+
+class FoldLineTest(unittest.TestCase):
+    def test_short_line_is_kept(self):
+        self.assertEqual(fold_line('SUMMARY:День рождения'), 'SUMMARY:День рождения\r\n')
+
+    def test_long_multibyte_line_is_folded_on_character_boundaries(self):
+        line = 'SUMMARY:' + 'Встреча выпускников в Новосибирске, ' * 10
+        folded = fold_line(line)
+        lines = folded[:-2].split('\r\n')
+        self.assertGreater(len(lines), 1)
+        for position, part in enumerate(lines):
+            self.assertLessEqual(len(part.encode()), LINE_OCTETS)
+            if position:
+                self.assertTrue(part.startswith(' '))
+        self.assertEqual(unfold(folded), line + '\r\n')
+
+class ICalendarExporterTest(unittest.TestCase):
+    def test_long_summary_is_folded(self):
+        file = io.StringIO()
+        exporter = ICalendarExporter(file, EVENT_FIELDS)
+        name = 'Юбилей ' + 'ё' * 100
+        exporter.write([('2026-10-05', name)])
+        exporter.close()
+        text = file.getvalue()
+        for line in text.split('\r\n'):
+            self.assertLessEqual(len(line.encode()), LINE_OCTETS)
+        self.assertIn('SUMMARY:' + name + '\r\n', unfold(text))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from datetime import date
+
+from protocol import CONTACT_FIELDS
+
+# Правила для полей ввода: какие символы разрешены дополнительно к классу символов
+# и строковый метод, которым проверяется все остальное. Таблицы удаления символов
+# собираются один раз, а проверка строки - два вызова на C вместо цикла по символам.
+RULES = {
+    'login': (str.maketrans('', '', '_'), str.isalnum),
+    'password': (str.maketrans('', '', '!#$%&()*+-:;<=>?@[]^_{|}~'), str.isalnum),
+    'word': (None, str.isalpha),
+    'word+dash': (str.maketrans('', '', '-'), str.isalpha), # названия из нескольких слов пишутся через '-'
+    'number': (None, str.isdigit),
+    'number+word': (None, str.isalnum),
+    'simple lable': (str.maketrans('', '', ' :-_'), str.isalnum),
+}
+
+MAX_FIELD_LENGTH = 64
+PHONE_LENGTH = 12 # '+' и 11 цифр
+REQUIRED_FIELDS = ('surname', 'name', 'phone')
+
+CONTACT_RULES = { # поле -> (правило, заголовок ошибки, текст ошибки)
+    'surname': ('word', 'Ошибка фамилии', 'Фамилия - одно слово'),
+    'name': ('word', 'Ошибка имени', 'Имя - одно слово'),
+    'patronymic': ('word', 'Ошибка отчества', 'Отчество - одно слово'),
+    'city': ('word+dash', 'Ошибка города', 'Город - одно слово\nЕсли ваш город имеет в названии более одного слова -> разделите их символом \'-\''),
+    'street': ('word+dash', 'Ошибка улицы', 'Улица - одно слово\nЕсли ваша улица имеет в названии более одного слова -> разделите их символом \'-\''),
+    'house_number': ('number+word', 'Ошибка номера дома', 'Номер дома может быть только число+буква'),
+    'apartment_number': ('number', 'Ошибка номера квартиры', 'Номер квартиры это число'),
+}
+
+def check_sql_injection(to_check, what_to_check): # True, если в строке есть запрещенные символы
+    table, predicate = RULES[what_to_check]
+    rest = to_check.translate(table) if table else to_check
+    return bool(rest) and not predicate(rest)
+
+DUPLICATE_PHONE = ('Ошибка контакта', 'Контакт с таким номером уже существует')
+BAD_BIRTH_DATE = ('Ошибка даты', 'Дата рождения - существующая дата в формате гггг-мм-дд')
+
+def is_iso_date(value): # строго 'yyyy-MM-dd' и такая дата есть в календаре
+    if len(value) != 10 or value[4] != '-' or value[7] != '-':
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+def validate_contact(contact, known_phones=(), own_phone=None): # -> {поле: (заголовок, текст)} в порядке полей, пустой словарь - контакт в порядке
+    errors = {}
+    for field in CONTACT_FIELDS:
+        value = contact.get(field, '')
+        if not value:
+            if field in REQUIRED_FIELDS:
+                errors[field] = ('Ошибка ввода', 'Заполните все поля')
+        elif field == 'phone':
+            if len(value) != PHONE_LENGTH:
+                errors[field] = ('Phone Error', 'Длина номера телефона - 11 символов')
+            elif normalize_phone(value) != own_phone and value in known_phones: # own_phone - номер изменяемого контакта
+                errors[field] = DUPLICATE_PHONE
+        elif field == 'birth_date': # ',' и ';' в дате сдвинули бы поля в пакетной команде
+            if not is_iso_date(value):
+                errors[field] = BAD_BIRTH_DATE
+        elif field in CONTACT_RULES:
+            rule, title, message = CONTACT_RULES[field]
+            if check_sql_injection(value, rule):
+                errors[field] = (title, message)
+            elif len(value) > MAX_FIELD_LENGTH:
+                errors[field] = ('Ошибка ввода', 'Слишком много данных на 1 поле, максимальная длина - 64 символа')
+    return errors
+
+def validate_contacts(records): # проверка пачки записей за один проход -> [(номер записи, ошибки)] только для ошибочных
+    invalid = []
+    for index, record in enumerate(records):
+        errors = validate_contact(record)
+        if errors:
+            invalid.append((index, errors))
+    return invalid
+
+DEFAULT_BIRTH_DATE = '2000-01-01' # дата, которую по умолчанию показывает поле даты в форме
+
+def normalize_contact(contact): # приведение записи к тому виду, в котором ее отдает форма добавления контакта
+    normalized = {field: (contact.get(field) or '').strip() for field in CONTACT_FIELDS}
+    for field in ('surname', 'name', 'patronymic'):
+        normalized[field] = normalized[field].capitalize()
+    normalized['phone'] = normalize_phone(normalized['phone'])
+    normalized['birth_date'] = normalize_date(normalized['birth_date'])
+    return normalized
+
+def normalize_phone(phone): # '+7 (912) 000-00-00' -> '+79120000000', уже приведенный номер возвращается как есть
+    if phone[:1] == '+' and phone[1:].isdigit():
+        return phone
+    digits = ''.join(char for char in phone if char.isdigit())
+    return '+' + digits if digits else ''
+
+def normalize_date(value): # 'yyyy-MM-dd', 'yyyyMMdd' или 'dd.MM.yyyy' -> 'yyyy-MM-dd'
+    if not value:
+        return DEFAULT_BIRTH_DATE
+    if len(value) == 8 and value.isdigit():
+        return f'{value[:4]}-{value[4:6]}-{value[6:]}'
+    day, dot, rest = value.partition('.')
+    if dot:
+        month, _, year = rest.partition('.')
+        return f'{year}-{month.zfill(2)}-{day.zfill(2)}'
+    return value
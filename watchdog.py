@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import time
+import traceback
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+STACK_DEPTH = 8 # столько кадров стека сохраняется для примера
+TOP_OFFENDERS = 10
+
+def stack_site(frame): # -> (место 'файл:строка в функции', короткий стек)
+    stack = traceback.extract_stack(frame)
+    own = [entry for entry in stack if entry.filename.startswith(PACKAGE_DIR)]
+    entry = own[-1] if own else stack[-1] # самый глубокий вызов из кода приложения, иначе просто самый глубокий
+    site = f'{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}'
+    return site, ''.join(traceback.format_list(stack[-STACK_DEPTH:]))
+
+class StallSite: # один источник зависаний
+    __slots__ = ('stalls', 'total', 'maximum', 'stack')
+
+    def __init__(self, stack):
+        self.stalls = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.stack = stack
+
+class StallWatchdog: # поток интерфейса отмечается beat(), сторожевой поток замечает паузы и снимает его стек
+    def __init__(self, threshold=0.2, log=print):
+        self.threshold = threshold # пауза дольше этого считается зависанием, секунды
+        self.interval = max(threshold / 4, 0.005) # как часто сторож проверяет отметку и снимает стек
+        self.log = log
+        self.thread_id = threading.get_ident() # создается в потоке интерфейса
+        self.last_beat = time.monotonic()
+        self.sites = {} # место -> StallSite
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.monitor = None
+
+    def beat(self): # вызывается таймером в потоке интерфейса
+        self.last_beat = time.monotonic()
+
+    def start(self):
+        self.beat()
+        self.monitor = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+        self.monitor.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.monitor:
+            self.monitor.join()
+            self.monitor = None
+
+    def watch(self):
+        stall_beat = None # отметка, после которой началось текущее зависание
+        samples = {} # место -> (число снимков за текущее зависание, стек)
+        while not self.stopped.wait(self.interval):
+            beat = self.last_beat
+            if stall_beat is not None and beat != stall_beat: # интерфейс снова отвечает
+                self.finish_stall(beat - stall_beat, samples)
+                stall_beat, samples = None, {}
+            if time.monotonic() - beat > self.threshold:
+                stall_beat = beat
+                frame = sys._current_frames().get(self.thread_id)
+                if frame is not None:
+                    site, stack = stack_site(frame)
+                    count, first_stack = samples.get(site, (0, stack))
+                    samples[site] = (count + 1, first_stack)
+                del frame
+
+    def finish_stall(self, duration, samples): # зависание приписывается месту, где стек застали чаще всего
+        if not samples:
+            return
+        site, (count, stack) = max(samples.items(), key=lambda item: item[1][0])
+        with self.lock:
+            stats = self.sites.get(site)
+            if stats is None:
+                stats = self.sites[site] = StallSite(stack)
+            stats.stalls += 1
+            stats.total += duration
+            stats.maximum = max(stats.maximum, duration)
+        self.log(f'UI stall {duration * 1000:.0f} ms at {site}')
+
+    def top(self, limit=TOP_OFFENDERS): # -> [(место, зависаний, всего мс, максимум мс, стек)] по суммарному времени
+        with self.lock:
+            sites = sorted(self.sites.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+            return [(site, stats.stalls, round(stats.total * 1000), round(stats.maximum * 1000), stats.stack) for site, stats in sites]
+
+    def report(self, limit=TOP_OFFENDERS): # итог для лога: худшие места с длительностями и примером стека
+        offenders = self.top(limit)
+        if not offenders:
+            return 'No UI stalls longer than %d ms' % (self.threshold * 1000)
+        lines = [f'Top UI stalls (threshold {self.threshold * 1000:.0f} ms):']
+        for site, stalls, total, maximum, stack in offenders:
+            lines.append(f'{total:>8} ms total {stalls:>5} stalls {maximum:>7} ms max  {site}')
+            lines.extend('        ' + line for line in stack.rstrip().splitlines())
+        return '\n'.join(lines)